@@ -1,11 +1,33 @@
 from django.conf.urls import patterns, include, url
 from tastypie.api import Api
-from tpasync.tests import EmptyTestResource, TestResource
+from tpasync.tests import (
+    EmptyTestResource, TestResource, EagerTestResource, CoalescingTestResource,
+    CachingTestResource, StreamingTestResource, WebhookTestResource,
+    AdmissionTestResource, SlowTestResource, MetricsTestResource,
+    ExecutorTestResource, RenderedTestResource, ChunkedTestResource,
+    FanOutTestResource, CompactTestResource, WatchedTestResource,
+    ExpiringTestResource, PartialTestResource)
 
 
 tpa_api = Api(api_name='v1')
 tpa_api.register(EmptyTestResource())
 tpa_api.register(TestResource())
+tpa_api.register(EagerTestResource())
+tpa_api.register(CoalescingTestResource())
+tpa_api.register(CachingTestResource())
+tpa_api.register(StreamingTestResource())
+tpa_api.register(WebhookTestResource())
+tpa_api.register(AdmissionTestResource())
+tpa_api.register(SlowTestResource())
+tpa_api.register(MetricsTestResource())
+tpa_api.register(ExecutorTestResource())
+tpa_api.register(RenderedTestResource())
+tpa_api.register(ChunkedTestResource())
+tpa_api.register(FanOutTestResource())
+tpa_api.register(CompactTestResource())
+tpa_api.register(WatchedTestResource())
+tpa_api.register(ExpiringTestResource())
+tpa_api.register(PartialTestResource())
 
 
 urlpatterns = patterns(
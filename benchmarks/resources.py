@@ -0,0 +1,27 @@
+from tastypie import fields
+from tpasync.resources import BaseAsyncResource
+
+from . import tasks
+
+
+class DoubleResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.IntegerField()
+
+    class Meta:
+        resource_name = 'double'
+
+    def async_get_detail(self, request, **kwargs):
+        return tasks.double.delay(int(kwargs['pk']))
+
+
+class ItemsResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'items'
+        max_limit = 0
+
+    def async_get_list(self, request, **kwargs):
+        return tasks.items.delay(int(request.GET.get('count', 100)))
@@ -0,0 +1,237 @@
+"""
+Benchmark submitting tasks, polling their state and fetching their results.
+
+Runs offline: tasks go through an in-memory broker to a worker thread in
+this process, and results are stored in an in-memory cache backend (see
+benchmarks.settings), so the numbers measure tastypie-async, tastypie and
+celery's publish, state and result paths, not a network broker. Each client
+thread repeats submit -> state (polled until the task is ready) -> result
+with a Django test client.
+
+    python benchmarks/run.py --scenario list --concurrency 4 --json out.json
+    python benchmarks/run.py --baseline out.json
+
+Reports requests per second, p50/p99 latency per step, objects retained per
+request (after a full collection, i.e. leaks, not transient allocations),
+state polls per task, growth of the finished state store, and peak RSS. With
+``--baseline``, exits with status 1 if throughput dropped or p99 latency
+rose by more than ``--tolerance``.
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # NOQA
+django.setup()
+
+# Configures the celery app from benchmarks.settings
+from app.celery import app  # NOQA
+from celery import states  # NOQA
+from celery.worker import state as worker_state  # NOQA
+from django.test import Client  # NOQA
+from tpasync.resources import FINISHED_STATES  # NOQA
+
+SCENARIOS = {
+    'detail': ('/api/v1/double/{i}/', ''),
+    'list': ('/api/v1/items/?count={size}', '?limit={limit}'),
+}
+STEPS = ('submit', 'state', 'result')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def start_worker():
+    """
+    Run a celery worker for the in-memory broker in a daemon thread.
+    """
+    worker = app.WorkController(
+        pool_cls='solo', concurrency=1, loglevel='WARNING',
+        without_heartbeat=True, without_mingle=True, without_gossip=True)
+    thread = threading.Thread(target=worker.start)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def client_loop(scenario, iterations, options, timings, errors):
+    submit_url, result_query = SCENARIOS[scenario]
+    client = Client()
+    for i in range(iterations):
+        started = time.time()
+        response = client.get(submit_url.format(i=i, size=options.size))
+        timings['submit'].append(time.time() - started)
+        if response.status_code != 202:
+            errors.append(('submit', response.status_code))
+            continue
+        state_url = response['Location']
+
+        while True:
+            started = time.time()
+            response = client.get(state_url)
+            timings['state'].append(time.time() - started)
+            if response.status_code != 200 or json.loads(
+                    response.content)['state'] in states.READY_STATES:
+                break
+            time.sleep(options.poll_interval)
+        if response.status_code != 200:
+            errors.append(('state', response.status_code))
+            continue
+
+        started = time.time()
+        response = client.get(
+            state_url.replace('/state/', '/result/') +
+            result_query.format(limit=options.limit))
+        timings['result'].append(time.time() - started)
+        if response.status_code != 200:
+            errors.append(('result', response.status_code))
+
+
+def run(options):
+    thread = start_worker()
+    try:
+        return measure(options)
+    finally:
+        # Warm shutdown, as on SIGTERM, the loop checks this flag
+        worker_state.should_stop = True
+        thread.join()
+
+
+def measure(options):
+    # Warm up imports, URL resolvers, serializers and the worker
+    client_loop(options.scenario, 5, options, {
+        step: [] for step in STEPS}, [])
+    FINISHED_STATES.clear()
+    gc.collect()
+    objects_before = len(gc.get_objects())
+
+    per_thread = options.requests // options.concurrency
+    timings = [{step: [] for step in STEPS}
+               for _ in range(options.concurrency)]
+    errors = []
+    threads = [
+        threading.Thread(target=client_loop, args=(
+            options.scenario, per_thread, options, timings[n], errors))
+        for n in range(options.concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    gc.collect()
+    tasks = per_thread * options.concurrency
+    requests = sum(
+        len(thread_timings[step])
+        for thread_timings in timings for step in STEPS)
+    results = {
+        'scenario': options.scenario,
+        'concurrency': options.concurrency,
+        'tasks': tasks,
+        'requests': requests,
+        'errors': len(errors),
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed,
+        'retained_objects_per_request': float(
+            len(gc.get_objects()) - objects_before) / max(requests, 1),
+        'state_polls_per_task': float(sum(
+            len(thread_timings['state']) for thread_timings in timings)) /
+        max(tasks, 1),
+        'finished_states': len(FINISHED_STATES),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'latency': {},
+    }
+    for step in STEPS:
+        values = [value for thread_timings in timings
+                  for value in thread_timings[step]]
+        results['latency'][step] = {
+            'p50': percentile(values, 0.5), 'p99': percentile(values, 0.99)}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return descriptions of regressions against ``baseline``.
+    """
+    if baseline['scenario'] != results['scenario'] or \
+            baseline['concurrency'] != results['concurrency']:
+        return ['baseline ran %(scenario)s at concurrency %(concurrency)d' %
+                baseline]
+    regressions = []
+    if results['requests_per_second'] < \
+            baseline['requests_per_second'] * (1 - tolerance):
+        regressions.append('requests/s %.1f < %.1f' % (
+            results['requests_per_second'], baseline['requests_per_second']))
+    for step in STEPS:
+        p99 = results['latency'][step]['p99']
+        before = baseline['latency'].get(step, {}).get('p99')
+        if p99 and before and p99 > before * (1 + tolerance):
+            regressions.append('%s p99 %.2fms > %.2fms' % (
+                step, p99 * 1000, before * 1000))
+    return regressions
+
+
+def report(results):
+    print('%(scenario)s: %(tasks)d tasks, %(requests)d requests, '
+          '%(errors)d errors in %(seconds).2fs' % results)
+    print('  %.1f requests/s' % results['requests_per_second'])
+    for step in STEPS:
+        latency = results['latency'][step]
+        if latency['p50'] is not None:
+            print('  %-7s p50 %7.2fms  p99 %7.2fms' % (
+                step, latency['p50'] * 1000, latency['p99'] * 1000))
+    print('  %.2f retained objects/request, %.1f state polls/task, '
+          '%d finished states, max RSS %d kB' % (
+              results['retained_objects_per_request'],
+              results['state_polls_per_task'], results['finished_states'],
+              results['max_rss_kb']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS),
+                        default='detail')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='tasks to submit, split between clients')
+    parser.add_argument('--size', type=int, default=1000,
+                        help='length of list results')
+    parser.add_argument('--limit', type=int, default=20,
+                        help='page size of list results, 0 for all')
+    parser.add_argument('--poll-interval', type=float, default=0.001,
+                        help='seconds between state requests of a task')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    options = parser.parse_args(argv)
+
+    results = run(options)
+    report(results)
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
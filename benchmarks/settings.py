@@ -0,0 +1,25 @@
+"""
+Settings for the benchmarks: no broker or result backend has to run, tasks
+are sent through an in-memory broker to a worker running in the benchmark
+process (see benchmarks.run), and their results are stored in an in-memory
+cache backend.
+"""
+from app.settings import *  # NOQA
+
+DEBUG = False
+TEMPLATE_DEBUG = False
+ALLOWED_HOSTS = ['testserver']
+ROOT_URLCONF = 'benchmarks.urls'
+MIDDLEWARE_CLASSES = ()
+
+BROKER_URL = 'memory://'
+# The worker polls the in-memory queue, don't let that dominate latency
+BROKER_TRANSPORT_OPTIONS = {'polling_interval': 0.001}
+CELERY_RESULT_BACKEND = 'cache+memory://'
+CELERY_ALWAYS_EAGER = False
+CELERY_IMPORTS = ('benchmarks.tasks',)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': True,
+}
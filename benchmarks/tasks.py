@@ -0,0 +1,11 @@
+from celery import shared_task
+
+
+@shared_task
+def double(number):
+    return {'id': 1, 'result': number * 2}
+
+
+@shared_task
+def items(count):
+    return [{'id': i, 'result': 'item %d' % i} for i in range(count)]
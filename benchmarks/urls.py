@@ -0,0 +1,15 @@
+from django.conf.urls import patterns, include, url
+from tastypie.api import Api
+
+from .resources import DoubleResource, ItemsResource
+
+
+api = Api(api_name='v1')
+api.register(DoubleResource())
+api.register(ItemsResource())
+
+
+urlpatterns = patterns(
+    '',
+    url(r'^api/', include(api.urls))
+)
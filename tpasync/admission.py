@@ -0,0 +1,127 @@
+"""
+Admission control for task submission.
+
+Set ``Meta.admission`` on a resource to one of these, like tastypie's
+``Meta.throttle``. Requests that are not admitted get the admission's
+``response_class`` with a ``Retry-After`` header, and no task is sent.
+"""
+import logging
+import math
+import threading
+import time
+
+from celery import current_app
+from django.http import HttpResponse
+from tastypie import http
+
+logger = logging.getLogger(__name__)
+
+
+class HttpServiceUnavailable(HttpResponse):
+    status_code = 503
+
+
+class BaseAdmission(object):
+    """
+    Admits all requests.
+    """
+    response_class = HttpServiceUnavailable
+
+    def retry_after(self, request):
+        """
+        Return None to admit ``request``, or the number of seconds the
+        client should wait before retrying.
+        """
+        return None
+
+    def reject(self, retry_after):
+        response = self.response_class()
+        response['Retry-After'] = str(int(math.ceil(retry_after)))
+        return response
+
+
+class QueueDepthAdmission(BaseAdmission):
+    """
+    Rejects requests with 503 while a broker queue is too long.
+
+    Requests are rejected while ``queue`` holds more than ``max_depth``
+    messages. The depth is looked up at most every ``cache_ttl`` seconds
+    per process, so checks don't cost a broker round-trip each.
+    ``Retry-After`` is the time needed to work off the excess messages at
+    ``drain_rate`` messages per second, but no less than ``cache_ttl``.
+
+    If the broker can't be asked, requests are admitted, and the lookup is
+    not retried for ``cache_ttl`` seconds either.
+    """
+
+    def __init__(self, queue='celery', max_depth=1000, drain_rate=10,
+                 cache_ttl=5, app=None, timer=time.time):
+        self.queue = queue
+        self.max_depth = max_depth
+        self.drain_rate = drain_rate
+        self.cache_ttl = cache_ttl
+        self.app = app
+        self.timer = timer
+        self._depth = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def get_depth(self):
+        """
+        Number of messages in the queue, as reported by the broker.
+        """
+        with (self.app or current_app).connection() as connection:
+            return connection.default_channel.queue_declare(
+                queue=self.queue, passive=True).message_count
+
+    def depth(self):
+        """
+        Cached queue depth, None if the broker couldn't be asked.
+        """
+        with self._lock:
+            if self._expires <= self.timer():
+                try:
+                    self._depth = self.get_depth()
+                except Exception:
+                    logger.exception(
+                        'Looking up the depth of queue %s failed', self.queue)
+                    self._depth = None
+                self._expires = self.timer() + self.cache_ttl
+            return self._depth
+
+    def retry_after(self, request):
+        depth = self.depth()
+        if depth is None:
+            return None
+        excess = depth - self.max_depth
+        if excess > 0:
+            return max(float(excess) / self.drain_rate, self.cache_ttl)
+
+
+class TokenBucketAdmission(BaseAdmission):
+    """
+    Rejects requests with 429 above a rate of submissions.
+
+    Admits ``rate`` requests per second on average, with bursts of up to
+    ``burst`` requests. The bucket is per process.
+    """
+    response_class = http.HttpTooManyRequests
+
+    def __init__(self, rate, burst=None, timer=time.time):
+        self.rate = float(rate)
+        self.burst = burst or max(int(rate), 1)
+        self.timer = timer
+        self._tokens = self.burst
+        self._updated = timer()
+        self._lock = threading.Lock()
+
+    def retry_after(self, request):
+        with self._lock:
+            now = self.timer()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return (1 - self._tokens) / self.rate
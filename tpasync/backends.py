@@ -0,0 +1,242 @@
+"""
+Helpers to talk to the celery result backend.
+"""
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from celery import current_app, signals, states
+from celery.backends.base import KeyValueStoreBackend
+from celery.exceptions import ImproperlyConfigured, TimeoutError
+from celery.result import AsyncResult
+from django.conf import settings
+
+try:
+    from celery.backends.database import (
+        DatabaseBackend, Task, session_cleanup)
+except (ImportError, ImproperlyConfigured):  # SQLAlchemy isn't installed
+    DatabaseBackend = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """
+    Shared thread pool for backends that can't look up many tasks at once.
+
+    Its size is set by ``TPASYNC_STATE_LOOKUP_THREADS`` (defaults to 8).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(
+                getattr(settings, 'TPASYNC_STATE_LOOKUP_THREADS', 8))
+        return _pool
+
+
+def _get_metas(task_ids, app):
+    """
+    Return decoded task meta dicts for key/value backends, else None.
+    """
+    backend = app.backend
+    if not isinstance(backend, KeyValueStoreBackend):
+        return None
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    values = backend.mget(keys)
+    if hasattr(values, 'items'):
+        values = [values.get(key) for key in keys]
+    return [
+        backend.decode_result(value) if value
+        else {'status': states.PENDING, 'result': None}
+        for value in values]
+
+
+def _state_key(backend, task_id):
+    return backend.get_key_for_task(task_id, key=':state')
+
+
+def _state_keys_enabled(backend):
+    return isinstance(backend, KeyValueStoreBackend) and \
+        getattr(settings, 'TPASYNC_STATE_KEYS', False)
+
+
+def get_state(task_id, app=None):
+    """
+    Return the state of ``task_id`` without fetching its result if possible.
+
+    Database backends select the status column only. With the
+    ``TPASYNC_STATE_KEYS`` setting, key/value backends read a small key
+    with the state written when the task finished, before falling back to
+    the task meta. Other backends fetch the whole meta.
+    """
+    backend = (app or current_app).backend
+    if DatabaseBackend is not None and isinstance(backend, DatabaseBackend):
+        session = backend.ResultSession()
+        with session_cleanup(session):
+            row = session.query(Task.status).filter(
+                Task.task_id == task_id).first()
+        return row[0] if row else states.PENDING
+    if _state_keys_enabled(backend):
+        state = backend.get(_state_key(backend, task_id))
+        if state:
+            return state
+    return backend.get_status(task_id)
+
+
+def get_states(task_ids, app=None):
+    """
+    Return a ``{task_id: state}`` dict for all ``task_ids``.
+
+    Key/value backends (redis, memcached, cache) are asked for all tasks
+    with a single ``mget``, of state keys first if ``TPASYNC_STATE_KEYS``
+    is set. Database backends select the status column of all tasks in a
+    single query. Other backends are queried in parallel using a bounded
+    thread pool. Unknown tasks are reported as ``PENDING``, like celery
+    does.
+    """
+    app = app or current_app
+    task_ids = list(task_ids)
+    found = {}
+    backend = app.backend
+    if DatabaseBackend is not None and isinstance(backend, DatabaseBackend):
+        found = dict.fromkeys(task_ids, states.PENDING)
+        if task_ids:
+            session = backend.ResultSession()
+            with session_cleanup(session):
+                found.update(session.query(Task.task_id, Task.status).filter(
+                    Task.task_id.in_(task_ids)))
+        return found
+    if _state_keys_enabled(backend):
+        keys = [_state_key(backend, task_id) for task_id in task_ids]
+        values = backend.mget(keys)
+        if hasattr(values, 'items'):
+            values = [values.get(key) for key in keys]
+        found.update(
+            (task_id, value) for task_id, value in zip(task_ids, values)
+            if value)
+    missing = [task_id for task_id in task_ids if task_id not in found]
+    if missing:
+        metas = _get_metas(missing, app)
+        if metas is not None:
+            found.update(
+                (task_id, meta['status'])
+                for task_id, meta in zip(missing, metas))
+        else:
+            found.update(zip(missing, _get_pool().map(
+                lambda task_id: get_state(task_id, app), missing)))
+    return found
+
+
+def get_results(task_ids, app=None):
+    """
+    Return a ``{task_id: result}`` dict for all ``task_ids``.
+
+    Works like ``get_states``, failed tasks have their exception as result.
+    """
+    app = app or current_app
+    task_ids = list(task_ids)
+    metas = _get_metas(task_ids, app)
+    if metas is not None:
+        found = [meta['result'] for meta in metas]
+    else:
+        found = _get_pool().map(
+            lambda task_id: AsyncResult(task_id, app=app).result, task_ids)
+    return dict(zip(task_ids, found))
+
+
+def forget_result(backend, task_id):
+    """
+    Delete the result of ``task_id`` from ``backend``, with its state key.
+
+    Backends that can't delete results (like ``amqp``, whose results are
+    consumed when read) are skipped.
+    """
+    if _state_keys_enabled(backend):
+        backend.delete(_state_key(backend, task_id))
+    try:
+        backend.forget(task_id)
+    except NotImplementedError:
+        pass
+
+
+class ResultBackend(object):
+    """
+    Access to the results of a celery app.
+
+    Celery creates one backend per app, whose connections are pooled by the
+    app. All lookups go through the backend of ``app`` (the current app by
+    default), results are bound to it. Set ``Meta.result_backend`` to use
+    another app for a resource.
+    """
+
+    def __init__(self, app=None):
+        self._app = app
+
+    @property
+    def app(self):
+        return self._app or current_app._get_current_object()
+
+    @property
+    def backend(self):
+        return self.app.backend
+
+    def result(self, task_id):
+        return self.app.AsyncResult(task_id)
+
+    def group(self, group_id):
+        return self.app.GroupResult.restore(group_id)
+
+    def get_state(self, task_id):
+        return get_state(task_id, self.app)
+
+    def get_states(self, task_ids):
+        return get_states(task_ids, self.app)
+
+    def get_results(self, task_ids):
+        return get_results(task_ids, self.app)
+
+    def forget(self, task_id):
+        forget_result(self.backend, task_id)
+
+
+RESULT_BACKEND = ResultBackend()
+
+
+@signals.task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    if state not in states.READY_STATES or task.request.is_eager:
+        return
+    backend = task.backend
+    if _state_keys_enabled(backend):
+        backend.set(_state_key(backend, task_id), state)
+
+
+def watch(task, timeout, interval=1.0):
+    """
+    Follow the state of ``task`` for at most ``timeout`` seconds.
+
+    Yields the state whenever it or the task meta changes (like progress
+    reported with ``update_state``), and None when neither changed for
+    ``interval`` seconds. Stops after the task is ready. Between reads the
+    generator blocks in the backend's own ``wait_for``, so backends that push
+    results (like ``amqp``) report completion as soon as it happens; other
+    states (``STARTED``, custom progress states) are read once per
+    ``interval``.
+    """
+    deadline = time.time() + timeout
+    previous = None
+    while True:
+        state = task.state
+        current = (state, None if state in states.READY_STATES else task.info)
+        yield state if current != previous else None
+        previous = current
+        remaining = deadline - time.time()
+        if state in states.READY_STATES or remaining <= 0:
+            return
+        try:
+            task.get(
+                timeout=min(interval, remaining), interval=interval,
+                propagate=False, no_ack=False)
+        except TimeoutError:
+            pass
@@ -0,0 +1,400 @@
+"""
+List results stored in chunks, so pages can be read without the whole list.
+
+Tasks decorated with ``tpasync.tasks.chunked`` write their list result in
+chunks of ``chunk_size`` objects to a chunk store, and return a small
+reference (key, count and chunk size) as their result. Result views hand
+a ``ChunkedList`` to the paginator, which reads only the chunks a page
+covers.
+
+Workers and web processes have to use the same store: set
+``TPASYNC_CHUNK_STORE`` to the dotted path of a store class and
+``TPASYNC_CHUNK_STORE_OPTIONS`` to its keyword arguments.
+``MemoryChunkStore``, the default, only works when tasks run in the web
+process (eager mode or tpasync.executors).
+
+With ``compress``, each chunk is compressed with zlib on its own, pages
+decompress only the chunks they read.
+
+Tasks decorated with ``tpasync.tasks.partial`` append chunks while they
+run, with a ``PartialWriter``. After each chunk, it replaces the reference
+kept under ``partial_key(task_id)``, so result views can serve the chunks
+written so far (see ``read_partial``).
+"""
+import json
+import mmap
+import os
+import tempfile
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+from .store import LocalStore
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+MARKER = '__tpasync_chunks__'
+
+
+class ChunksExpired(Exception):
+    """
+    The chunks of a result are not in the store (anymore).
+    """
+
+
+class MemoryChunkStore(object):
+    """
+    Keeps chunks in process, in a LocalStore of ``max_size`` results.
+    """
+
+    def __init__(self, max_size=100, ttl=None):
+        self.results = LocalStore(max_size=max_size, ttl=ttl)
+
+    def write(self, key, chunks):
+        self.results.set(key, list(chunks))
+
+    def append(self, key, chunks):
+        existing = self.results.get(key)
+        if existing is None:
+            self.write(key, chunks)
+        else:
+            existing.extend(chunks)
+
+    def read(self, key, first, last):
+        """
+        Return chunks ``first`` to ``last`` (inclusive) of ``key``.
+
+        Raises KeyError if there is no result for ``key`` (anymore).
+        """
+        return self.results[key][first:last + 1]
+
+    def delete(self, key):
+        self.results.delete(key)
+
+
+class FileChunkStore(object):
+    """
+    Keeps chunks in files in ``directory``, read by memory mapping.
+
+    Each result is a data file with all chunks and an index file with
+    their offsets. The directory has to be shared between workers and web
+    processes, files are never expired.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, '%s.%s' % (key, extension))
+
+    def _write_file(self, path, parts):
+        # Write to a temporary file first, readers never see partial files
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as f:
+            for part in parts:
+                f.write(part)
+        os.rename(temp_path, path)
+
+    def write(self, key, chunks):
+        offsets = [0]
+        for chunk in chunks:
+            offsets.append(offsets[-1] + len(chunk))
+        self._write_file(self._path(key, 'chunks'), chunks)
+        self._write_file(self._path(key, 'index'), [json.dumps(offsets)])
+
+    def _read_index(self, key):
+        with open(self._path(key, 'index'), 'rb') as f:
+            return json.load(f)
+
+    def append(self, key, chunks):
+        try:
+            offsets = self._read_index(key)
+        except IOError:
+            return self.write(key, chunks)
+        with open(self._path(key, 'chunks'), 'ab') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                offsets.append(offsets[-1] + len(chunk))
+        # Readers only see the new chunks once the index is replaced
+        self._write_file(self._path(key, 'index'), [json.dumps(offsets)])
+
+    def read(self, key, first, last):
+        try:
+            offsets = self._read_index(key)
+            f = open(self._path(key, 'chunks'), 'rb')
+        except IOError:
+            raise KeyError(key)
+        with f:
+            if offsets[-1] == 0:
+                return []
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return [
+                    data[offsets[i]:offsets[i + 1]]
+                    for i in range(first, min(last + 1, len(offsets) - 1))]
+            finally:
+                data.close()
+
+    def delete(self, key):
+        for extension in ('index', 'chunks'):
+            try:
+                os.remove(self._path(key, extension))
+            except OSError:
+                pass
+
+
+class RedisChunkStore(object):
+    """
+    Keeps chunks in redis lists, read with ``LRANGE``.
+
+    Requires the ``redis`` package. Results expire after ``ttl`` seconds if
+    given.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=None,
+                 prefix='tpasync-chunks'):
+        if redis is None:
+            raise ImportError('RedisChunkStore requires the redis package')
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, key):
+        return '%s:%s' % (self.prefix, key)
+
+    def write(self, key, chunks):
+        key = self._key(key)
+        pipeline = self.client.pipeline()
+        pipeline.delete(key)
+        if chunks:
+            pipeline.rpush(key, *chunks)
+        if self.ttl:
+            pipeline.expire(key, self.ttl)
+        pipeline.execute()
+
+    def append(self, key, chunks):
+        key = self._key(key)
+        pipeline = self.client.pipeline()
+        pipeline.rpush(key, *chunks)
+        if self.ttl:
+            pipeline.expire(key, self.ttl)
+        pipeline.execute()
+
+    def read(self, key, first, last):
+        chunks = self.client.lrange(self._key(key), first, last)
+        # Any empty range may be a result that expired
+        if not chunks and not self.client.exists(self._key(key)):
+            raise KeyError(key)
+        return chunks
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+
+def _get_store():
+    path = getattr(settings, 'TPASYNC_CHUNK_STORE', None)
+    if not path:
+        return MemoryChunkStore()
+    return import_string(path)(
+        **getattr(settings, 'TPASYNC_CHUNK_STORE_OPTIONS', {}))
+
+
+CHUNK_STORE = _get_store()
+
+
+def write(objects, chunk_size=1000, store=None, compress=False):
+    """
+    Write the list ``objects`` to ``store`` in chunks, return its reference.
+    """
+    objects = list(objects)
+    key = uuid.uuid4().hex
+    encoded = (
+        json.dumps(objects[i:i + chunk_size], cls=DjangoJSONEncoder)
+        for i in range(0, len(objects), chunk_size))
+    if compress:
+        encoded = (zlib.compress(chunk) for chunk in encoded)
+    (store or CHUNK_STORE).write(key, list(encoded))
+    reference = {
+        MARKER: key, 'count': len(objects), 'chunk_size': chunk_size}
+    if compress:
+        reference['compressed'] = True
+    return reference
+
+
+def is_chunked(value):
+    return isinstance(value, dict) and MARKER in value
+
+
+def partial_key(key):
+    return '%s.partial' % key
+
+
+def read_partial(key, store=None):
+    """
+    Return the reference to the chunks written so far for ``key``, or None.
+    """
+    try:
+        read = (store or CHUNK_STORE).read(partial_key(key), 0, 0)
+    except KeyError:
+        return None
+    return json.loads(read[0]) if read else None
+
+
+class PartialWriter(object):
+    """
+    Appends objects to the chunks of ``key`` in chunks of ``chunk_size``.
+
+    Only full chunks are written until ``close``, which writes the rest and
+    returns the reference to all chunks.
+    """
+
+    def __init__(self, key, chunk_size=1000, store=None):
+        self.key = key
+        self.chunk_size = chunk_size
+        self.store = store or CHUNK_STORE
+        self.count = 0
+        self.buffer = []
+        self.store.write(key, [])
+        self._publish()
+
+    def reference(self):
+        return {MARKER: self.key, 'count': self.count,
+                'chunk_size': self.chunk_size}
+
+    def _publish(self):
+        self.store.write(partial_key(self.key), [json.dumps(self.reference())])
+
+    def _flush(self, objects):
+        self.store.append(
+            self.key, [json.dumps(objects, cls=DjangoJSONEncoder)])
+        self.count += len(objects)
+        self._publish()
+
+    def extend(self, objects):
+        self.buffer.extend(objects)
+        while len(self.buffer) >= self.chunk_size:
+            self._flush(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+
+    def close(self):
+        if self.buffer:
+            self._flush(self.buffer)
+            self.buffer = []
+        return self.reference()
+
+    def delete(self):
+        """
+        Delete the chunks written so far and their reference.
+        """
+        self.store.delete(self.key)
+        self.store.delete(partial_key(self.key))
+
+
+class ChunkedList(object):
+    """
+    Sequence of the objects of a chunked result, for paginators.
+
+    Slicing reads the chunks the slice covers from ``store``, the length is
+    known from the reference. Raises ChunksExpired if the chunks are gone.
+    """
+
+    def __init__(self, reference, store=None):
+        self.reference = reference
+        self.key = reference[MARKER]
+        self.length = reference['count']
+        self.chunk_size = reference['chunk_size']
+        self.compressed = reference.get('compressed', False)
+        self.store = store or CHUNK_STORE
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('Chunked results can only be sliced')
+        start, stop, _ = index.indices(self.length)
+        if start >= stop:
+            return []
+        first = start // self.chunk_size
+        objects = self.read(first, (stop - 1) // self.chunk_size)
+        offset = first * self.chunk_size
+        return objects[start - offset:stop - offset]
+
+    def read(self, first, last):
+        """
+        Return the objects of chunks ``first`` to ``last`` (inclusive).
+        """
+        try:
+            read = self.store.read(self.key, first, last)
+        except KeyError:
+            raise ChunksExpired(self.key)
+        objects = []
+        for chunk in read:
+            if self.compressed:
+                chunk = zlib.decompress(chunk)
+            objects.extend(json.loads(chunk))
+        return objects
+
+    def lazy(self):
+        """
+        Return a LazyChunkedList of the same chunks.
+        """
+        return LazyChunkedList(self.reference, self.store)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def delete(self):
+        self.store.delete(self.key)
+        self.store.delete(partial_key(self.key))
+
+
+class LazyChunkedList(ChunkedList):
+    """
+    ChunkedList whose slices read their chunks one at a time while they are
+    iterated, for streamed responses.
+    """
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('Chunked results can only be sliced')
+        start, stop, _ = index.indices(self.length)
+        return ChunkedSlice(self, start, stop)
+
+
+class ChunkedSlice(object):
+    """
+    Objects ``start`` to ``stop`` of a ChunkedList, read chunk by chunk.
+
+    The first chunk is read right away, so expired chunks raise
+    ChunksExpired before a response starts.
+    """
+
+    def __init__(self, objects, start, stop):
+        self.objects = objects
+        self.start = start
+        self.stop = max(start, stop)
+        self.first = start // objects.chunk_size
+        self._first_objects = objects.read(self.first, self.first) \
+            if self.start < self.stop else []
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        chunk_size = self.objects.chunk_size
+        for index in range(self.first, (self.stop - 1) // chunk_size + 1):
+            if index == self.first:
+                objects = self._first_objects
+            else:
+                objects = self.objects.read(index, index)
+            offset = index * chunk_size
+            for obj in objects[
+                    max(self.start - offset, 0):self.stop - offset]:
+                yield obj
@@ -0,0 +1,106 @@
+"""
+Compact encodings of task results, for storage and transport.
+
+Importing this module (tpasync.tasks does) registers serializers for result
+backends that compress JSON or msgpack with zlib or zstd::
+
+    CELERY_RESULT_SERIALIZER = 'json+zlib'
+    CELERY_ACCEPT_CONTENT = ['json', 'application/x-tpasync-json+zlib']
+
+``json+zlib`` is always available, ``msgpack+zlib``, ``json+zstd`` and
+``msgpack+zstd`` if the ``msgpack`` and ``zstandard`` packages are
+installed. Celery uses one result serializer per app, so set it for the app
+of the workers that run tasks with large results.
+
+``CompactSerializer`` adds msgpack (``application/x-msgpack``) to tastypie's
+formats, set it as ``Meta.serializer`` of a resource. Responses are gzipped
+with ``Meta.compress_results``, see ``AsyncResourceMixin.async_result``.
+"""
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from kombu.serialization import register
+from tastypie.serializers import Serializer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _dumps_json(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def _dumps_msgpack(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _loads_msgpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _compressed(dumps, loads, compress, decompress):
+    return (lambda value: compress(dumps(value)),
+            lambda data: loads(decompress(data)))
+
+
+def register_serializers():
+    """
+    Register the compressed serializers whose packages are installed.
+    """
+    encodings = [('json', _dumps_json, json.loads)]
+    if msgpack is not None:
+        encodings.append(('msgpack', _dumps_msgpack, _loads_msgpack))
+    compressions = [('zlib', zlib.compress, zlib.decompress)]
+    if zstandard is not None:
+        compressions.append(('zstd', _zstd_compress, _zstd_decompress))
+    for name, dumps, loads in encodings:
+        for compression, compress, decompress in compressions:
+            encoder, decoder = _compressed(
+                dumps, loads, compress, decompress)
+            register(
+                '%s+%s' % (name, compression), encoder, decoder,
+                content_type='application/x-tpasync-%s+%s' % (
+                    name, compression),
+                content_encoding='binary')
+
+
+register_serializers()
+
+
+class CompactSerializer(Serializer):
+    """
+    Tastypie serializer with msgpack, for clients that send
+    ``Accept: application/x-msgpack``.
+
+    Requires the ``msgpack`` package.
+    """
+    formats = ['json', 'msgpack']
+    content_types = dict(
+        Serializer.content_types, msgpack='application/x-msgpack')
+
+    def __init__(self, *args, **kwargs):
+        if msgpack is None:
+            raise ImportError('CompactSerializer requires the msgpack package')
+        super(CompactSerializer, self).__init__(*args, **kwargs)
+
+    def to_msgpack(self, data, options=None):
+        return _dumps_msgpack(self.to_simple(data, options or {}))
+
+    def from_msgpack(self, content):
+        return _loads_msgpack(content)
@@ -0,0 +1,280 @@
+"""
+Run tasks in local thread or process pools, without a broker.
+
+Set ``Meta.executor`` on a resource to a ``ThreadExecutor`` or
+``ProcessExecutor``. Signatures returned by its async_* hooks are then run
+by the pool instead of being sent to the broker, requests get their 202
+right away, and state and result views read from the executor. Hooks have
+to return signatures (``task.s(...)``), returning results of tasks they
+ran or sent themselves raises ImproperlyConfigured. Groups and chains run
+as one job, a group's result is the list of its children's results.
+
+Results are kept in process (``max_results`` of them, for ``result_ttl``
+seconds), so use a single web process, e.g. for edge or single node
+deployments. Completion callbacks are called by the executor once a job
+finished, delivering them still needs a broker.
+"""
+import logging
+import threading
+import time
+from multiprocessing.pool import Pool, ThreadPool
+
+from celery import current_app, states, uuid
+from celery.backends.base import BaseBackend
+from celery.exceptions import TimeoutError
+from celery.result import AsyncResult, ResultSet
+
+from .store import LocalStore
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend(BaseBackend):
+    """
+    Result backend that keeps task metas in a LocalStore.
+    """
+    persistent = False
+
+    def __init__(self, app, max_results=10000, result_ttl=3600, **kwargs):
+        super(LocalBackend, self).__init__(
+            app, max_cached_results=-1, **kwargs)
+        self.metas = LocalStore(max_size=max_results, ttl=result_ttl)
+        self._finished = threading.Condition()
+
+    def __contains__(self, task_id):
+        return task_id in self.metas
+
+    def _store_result(self, task_id, result, status, traceback=None,
+                      request=None, **kwargs):
+        meta = {'task_id': task_id, 'status': status, 'result': result,
+                'traceback': traceback, 'children': None}
+        with self._finished:
+            self.metas.set(task_id, meta)
+            if status in states.READY_STATES:
+                self._finished.notify_all()
+        return result
+
+    def _get_task_meta_for(self, task_id):
+        meta = self.metas.get(task_id)
+        if meta is None:
+            return {'task_id': task_id, 'status': states.PENDING,
+                    'result': None}
+        return self.meta_from_decoded(dict(meta))
+
+    def _forget(self, task_id):
+        self.metas.delete(task_id)
+
+    def start(self, task_id):
+        """
+        Mark the task as started unless it was revoked, return whether it
+        was.
+        """
+        with self._finished:
+            if self.get_status(task_id) == states.REVOKED:
+                return False
+            self.mark_as_started(task_id)
+            return True
+
+    def revoke_pending(self, task_id):
+        """
+        Mark the task as revoked if it hasn't started, return whether it
+        was.
+        """
+        with self._finished:
+            if self.get_status(task_id) != states.PENDING:
+                return False
+            self.mark_as_revoked(task_id)
+            return True
+
+    def wait_for(self, task_id, timeout=None, interval=0.5, no_ack=True,
+                 on_interval=None):
+        """
+        Wait for the task to finish, woken up as soon as it does.
+        """
+        deadline = time.time() + timeout if timeout else None
+        with self._finished:
+            while True:
+                meta = self.get_task_meta(task_id)
+                if meta['status'] in states.READY_STATES:
+                    return meta
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('The operation timed out.')
+                self._finished.wait(remaining)
+
+
+class LocalResult(AsyncResult):
+    """
+    Result of a task run by an executor.
+    """
+
+    def __init__(self, id, executor, task_name=None):
+        super(LocalResult, self).__init__(
+            id, backend=executor.backend, task_name=task_name,
+            app=executor.app)
+        self.executor = executor
+
+    def revoke(self, connection=None, terminate=False, signal=None,
+               wait=False, timeout=None):
+        """
+        Revoke the task if it hasn't started yet.
+
+        Running tasks can't be terminated, ``terminate`` is ignored.
+        """
+        self.executor.revoke(self.id)
+
+
+def _run(signature, task_id, backend=None):
+    """
+    Apply ``signature`` and return its state, result and traceback.
+
+    ``backend`` is only passed by thread pools, whose jobs can report the
+    task as started and skip revoked tasks.
+    """
+    if backend is not None and not backend.start(task_id):
+        return None
+    try:
+        result = signature.apply(task_id=task_id)
+        if isinstance(result, ResultSet):
+            for child in result.results:
+                if child.failed():
+                    return child.state, child.result, child.traceback
+            return states.SUCCESS, [
+                child.result for child in result.results], None
+        return result.state, result.result, result.traceback
+    except Exception, error:
+        return states.FAILURE, error, None
+
+
+class LocalExecutor(object):
+    """
+    Base class of executors, runs tasks in the pool made by ``get_pool``.
+
+    The pool is started with the first task.
+    """
+    pool_class = ThreadPool
+    pass_backend = True
+
+    def __init__(self, workers=None, max_results=10000, result_ttl=3600,
+                 app=None):
+        self.workers = workers
+        self.max_results = max_results
+        self.result_ttl = result_ttl
+        self._app = app
+        self._backend = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._callbacks_lock = threading.Lock()
+
+    @property
+    def app(self):
+        return self._app or current_app._get_current_object()
+
+    @property
+    def backend(self):
+        with self._lock:
+            if self._backend is None:
+                self._backend = LocalBackend(
+                    self.app, max_results=self.max_results,
+                    result_ttl=self.result_ttl)
+            return self._backend
+
+    def get_pool(self):
+        return self.pool_class(self.workers)
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self.get_pool()
+            return self._pool
+
+    def submit(self, signature):
+        """
+        Run ``signature`` in the pool, return its LocalResult.
+        """
+        task_id = signature.options.get('task_id') or uuid()
+        backend = self.backend
+        backend.store_result(task_id, None, states.PENDING)
+
+        def finished(value):
+            if value is None or \
+                    backend.get_status(task_id) == states.REVOKED:
+                return
+            state, result, traceback = value
+            backend.store_result(task_id, result, state, traceback)
+            self._done(task_id)
+
+        self.pool.apply_async(_run, (
+            signature, task_id, backend if self.pass_backend else None),
+            callback=finished)
+        return LocalResult(task_id, self, task_name=signature.get('task'))
+
+    def get_result(self, task_id):
+        """
+        Return the LocalResult for ``task_id``, or None if it's unknown.
+        """
+        if task_id in self.backend:
+            return LocalResult(task_id, self)
+
+    def revoke(self, task_id):
+        """
+        Revoke the task if it hasn't started yet, return whether it was.
+        """
+        if not self.backend.revoke_pending(task_id):
+            return False
+        self._done(task_id)
+        return True
+
+    def add_done_callback(self, task_id, callback):
+        """
+        Call ``callback`` with the LocalResult of ``task_id`` once the task
+        is ready (right away if it already is).
+
+        Callbacks run in the thread that handles pool results, they should
+        be quick, e.g. send a task.
+        """
+        with self._callbacks_lock:
+            if self.backend.get_status(task_id) not in states.READY_STATES:
+                self._callbacks.setdefault(task_id, []).append(callback)
+                return
+        callback(LocalResult(task_id, self))
+
+    def _done(self, task_id):
+        with self._callbacks_lock:
+            callbacks = self._callbacks.pop(task_id, [])
+        for callback in callbacks:
+            # An exception would stop the pool from handling results
+            try:
+                callback(LocalResult(task_id, self))
+            except Exception:
+                logger.exception('Callback of %s failed', task_id)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+class ThreadExecutor(LocalExecutor):
+    """
+    Runs tasks in a pool of ``workers`` threads (the number of CPUs by
+    default). Suited for tasks that wait on I/O or release the GIL.
+    """
+
+
+class ProcessExecutor(LocalExecutor):
+    """
+    Runs tasks in a pool of ``workers`` processes (the number of CPUs by
+    default), to use all cores for CPU bound tasks.
+
+    Signatures and results have to be picklable. Workers are forked from
+    the first process that submits a task, revoked tasks that already went
+    to a worker still run.
+    """
+    pool_class = Pool
+    pass_backend = False
@@ -0,0 +1,178 @@
+"""
+Result expiry and deletion.
+
+Resources with ``Meta.result_ttl`` register their tasks in an expiry
+registry when they are submitted, with the time their result may be
+forgotten. The ``tpasync.tasks.sweep_results`` task forgets results past
+that time. Schedule it with celery beat::
+
+    CELERYBEAT_SCHEDULE = {
+        'sweep-results': {
+            'task': 'tpasync.tasks.sweep_results', 'schedule': 60}}
+
+The registry has to be shared by web processes and the worker running the
+sweeper: set ``TPASYNC_EXPIRY_REGISTRY`` to the dotted path of a registry
+class and ``TPASYNC_EXPIRY_REGISTRY_OPTIONS`` to its keyword arguments.
+``LocalExpiryRegistry``, the default, only works when tasks run in the web
+process (eager mode or tpasync.executors).
+
+Forgetting a result deletes its task meta and state key in the result
+backend, and its chunks (see tpasync.chunks). As the sweeper runs without
+resources, it uses the default result backend and chunk store, resources
+can't combine ``Meta.result_ttl`` with their own.
+"""
+import heapq
+import logging
+import threading
+import time
+
+from celery import states
+from celery.result import AsyncResult
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import chunks
+from .backends import RESULT_BACKEND, forget_result
+from .metrics import METRICS
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class LocalExpiryRegistry(object):
+    """
+    Keeps expiry times in process.
+    """
+
+    def __init__(self):
+        self._expires = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def add(self, task_id, expires):
+        with self._lock:
+            self._expires[task_id] = expires
+            heapq.heappush(self._heap, (expires, task_id))
+
+    def remove(self, task_id):
+        with self._lock:
+            self._expires.pop(task_id, None)
+
+    def pop_expired(self, now, limit=1000):
+        """
+        Remove and return the ids of up to ``limit`` tasks expired at
+        ``now``.
+        """
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and \
+                    len(expired) < limit:
+                expires, task_id = heapq.heappop(self._heap)
+                # Skip entries of removed or re-added tasks
+                if self._expires.get(task_id) == expires:
+                    del self._expires[task_id]
+                    expired.append(task_id)
+        return expired
+
+    def __len__(self):
+        return len(self._expires)
+
+
+class RedisExpiryRegistry(object):
+    """
+    Keeps expiry times in a redis sorted set.
+
+    Requires the ``redis`` package. Several sweepers can run at once, each
+    expired task is handed to one of them.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0',
+                 key='tpasync-expiry'):
+        if redis is None:
+            raise ImportError(
+                'RedisExpiryRegistry requires the redis package')
+        self.client = redis.StrictRedis.from_url(url)
+        self.key = key
+
+    def add(self, task_id, expires):
+        self.client.zadd(self.key, {task_id: expires})
+
+    def remove(self, task_id):
+        self.client.zrem(self.key, task_id)
+
+    def pop_expired(self, now, limit=1000):
+        task_ids = self.client.zrangebyscore(
+            self.key, '-inf', now, start=0, num=limit)
+        if not task_ids:
+            return []
+        pipeline = self.client.pipeline()
+        for task_id in task_ids:
+            pipeline.zrem(self.key, task_id)
+        return [
+            task_id for task_id, removed in zip(task_ids, pipeline.execute())
+            if removed]
+
+    def __len__(self):
+        return self.client.zcard(self.key)
+
+
+def _get_registry():
+    path = getattr(settings, 'TPASYNC_EXPIRY_REGISTRY', None)
+    if not path:
+        return LocalExpiryRegistry()
+    return import_string(path)(
+        **getattr(settings, 'TPASYNC_EXPIRY_REGISTRY_OPTIONS', {}))
+
+
+EXPIRY_REGISTRY = _get_registry()
+
+
+def forget(task, chunk_store=None):
+    """
+    Forget the result of ``task``, an AsyncResult, and its chunks.
+    """
+    if task.state == states.SUCCESS and chunks.is_chunked(task.result):
+        chunks.ChunkedList(task.result, chunk_store).delete()
+    if task.backend is not None:
+        forget_result(task.backend, task.id)
+
+
+def sweep(registry=None, result_backend=None, stores=(), chunk_store=None,
+          limit=1000, metrics=None):
+    """
+    Forget results that expired in ``registry``.
+
+    Expired tasks are deleted from ``stores`` too, eager results found there
+    are forgotten instead of looking the task up in ``result_backend``.
+    Then expired entries of ``stores`` are purged. Returns the number of
+    ``expired``, ``failed`` and ``purged`` entries, which are counted in
+    ``tpasync_swept_total`` as well.
+    """
+    if registry is None:
+        registry = EXPIRY_REGISTRY
+    result_backend = result_backend or RESULT_BACKEND
+    counts = {'expired': 0, 'failed': 0, 'purged': 0}
+    for task_id in registry.pop_expired(time.time(), limit):
+        counts['expired'] += 1
+        task = None
+        for store in stores:
+            value = store.get(task_id)
+            if isinstance(value, AsyncResult):
+                task = value
+            store.delete(task_id)
+        try:
+            forget(task or result_backend.result(task_id), chunk_store)
+        except Exception:
+            logger.exception('Forgetting the result of %s failed', task_id)
+            counts['failed'] += 1
+    for store in stores:
+        counts['purged'] += store.purge()
+    metrics = metrics or METRICS
+    for outcome, count in counts.items():
+        if count:
+            metrics.increment('tpasync_swept_total', count, outcome=outcome)
+    return counts
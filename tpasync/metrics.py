@@ -0,0 +1,185 @@
+"""
+Metrics of the request lifecycle.
+
+Resources report timings and counters to ``Meta.metrics``, or to the
+module-wide ``METRICS`` by default. That is a ``NullMetrics``, which does
+nothing, unless the ``TPASYNC_METRICS`` setting names another class, e.g.
+``'tpasync.metrics.PrometheusMetrics'``. Expose the latter with
+``metrics_view``::
+
+    url(r'^metrics$', 'tpasync.metrics.metrics_view')
+
+Reported metrics (all labeled with ``resource``):
+
+* ``tpasync_hook_seconds`` (and ``method``): time spent in async_* hooks
+* ``tpasync_publish_seconds``: time to send signatures returned by hooks
+* ``tpasync_backend_seconds`` (and ``view``): result backend lookups
+* ``tpasync_states_total`` (and ``state``): task states seen by state views
+* ``tpasync_paginate_seconds``: sorting and pagination of list results
+* ``tpasync_dehydrate_seconds``, ``tpasync_serialize_seconds``
+* ``tpasync_response_bytes``: size of result responses
+
+``tpasync.expiry.sweep`` reports ``tpasync_swept_total`` (by ``outcome``).
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+from django.utils.module_loading import import_string
+
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    float('inf'))
+SIZE_BUCKETS = (
+    2 ** 8, 2 ** 10, 2 ** 12, 2 ** 14, 2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22,
+    2 ** 24, float('inf'))
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _Timer(object):
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = self.metrics.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(
+            self.name, self.metrics.clock() - self.start, **self.labels)
+
+
+class NullMetrics(object):
+    """
+    Discards everything.
+    """
+    enabled = False
+    _timer = _NullTimer()
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        """
+        Context manager that observes the time spent in it as ``name``.
+        """
+        return self._timer
+
+
+class PrometheusMetrics(NullMetrics):
+    """
+    Keeps counters and histograms in process, ``render()`` returns them in
+    the Prometheus text format.
+
+    Histograms of metrics named ``*_bytes`` use ``SIZE_BUCKETS``, all others
+    ``buckets``. Like any in-process registry, each process reports its own
+    numbers, scrape every process.
+    """
+    enabled = True
+
+    def __init__(self, buckets=BUCKETS, clock=time.time):
+        self.buckets = buckets
+        self.clock = clock
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = SIZE_BUCKETS if name.endswith('_bytes') else self.buckets
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0.0, [0] * len(buckets)]
+            hist[0] += value
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[1][i] += 1
+                    break
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (total, list(counts)))
+                for key, (total, counts) in self._histograms.items())
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append('# TYPE %s counter' % name)
+            lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+        for (name, labels), (total, counts) in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            buckets = SIZE_BUCKETS if name.endswith('_bytes') else \
+                self.buckets
+            cumulative = 0
+            for bound, count in zip(buckets, counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, _labels(labels + (('le', _number(bound)),)),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (
+                name, _labels(labels), _number(total)))
+            lines.append('%s_count%s %d' % (
+                name, _labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, unicode(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _get_metrics():
+    path = getattr(settings, 'TPASYNC_METRICS', None)
+    return import_string(path)() if path else NullMetrics()
+
+
+METRICS = _get_metrics()
+
+
+def metrics_view(request, metrics=None):
+    """
+    Metrics in the Prometheus text format.
+    """
+    metrics = metrics or METRICS
+    if not hasattr(metrics, 'render'):
+        raise Http404
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4')
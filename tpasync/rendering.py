@@ -0,0 +1,88 @@
+"""
+Results rendered to JSON on the worker.
+
+Tasks decorated with ``tpasync.tasks.rendered`` return the JSON
+representation of their result instead of the result itself. Result views
+return it as is, without dehydrating or serializing anything. List results
+are rendered in pages of ``page_size`` objects (one page by default), only
+the pages a request covers are joined (or decoded, for pages that are cut)
+by the web process.
+
+The representation is not dehydrated by the resource: the task result has
+to look like the response should. Requests for other formats than JSON
+decode the result and take the usual path.
+"""
+import json
+
+from tastypie.serializers import Serializer
+
+MARKER = '__tpasync_rendered__'
+
+
+def render(value, page_size=None):
+    """
+    Return ``value`` rendered to JSON, in pages if it's a list.
+
+    Lists are rendered as a single page without ``page_size``, so they are
+    paginated like other list results.
+    """
+    serializer = Serializer()
+    if isinstance(value, (list, tuple)):
+        page_size = page_size or max(len(value), 1)
+        return {
+            MARKER: 1, 'count': len(value), 'page_size': page_size,
+            'pages': [
+                serializer.to_json(value[i:i + page_size])
+                for i in range(0, len(value), page_size)]}
+    return {MARKER: 1, 'content': serializer.to_json(value)}
+
+
+def is_rendered(value):
+    return isinstance(value, dict) and MARKER in value
+
+
+def decode(rendered):
+    """
+    Return the value ``rendered`` was rendered from (as JSON decodes it).
+    """
+    if 'pages' in rendered:
+        return RenderedPages(rendered).decode(0, rendered['count'])
+    return json.loads(rendered['content'])
+
+
+class RenderedPages(object):
+    """
+    Sequence of the objects of a paged rendered result, for paginators.
+
+    Slicing returns the JSON of the objects in the slice.
+    """
+
+    def __init__(self, rendered):
+        self.length = rendered['count']
+        self.page_size = rendered['page_size']
+        self.pages = rendered['pages']
+
+    def __len__(self):
+        return self.length
+
+    def decode(self, start, stop):
+        first, last = start // self.page_size, (stop - 1) // self.page_size
+        objects = []
+        for page in self.pages[first:last + 1]:
+            objects.extend(json.loads(page))
+        offset = first * self.page_size
+        return objects[start - offset:stop - offset]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('Rendered results can only be sliced')
+        start, stop, _ = index.indices(self.length)
+        if start >= stop:
+            return '[]'
+        if start % self.page_size == 0 and (
+                stop % self.page_size == 0 or stop == self.length):
+            pages = self.pages[
+                start // self.page_size:
+                (stop + self.page_size - 1) // self.page_size]
+            return '[%s]' % ', '.join(page[1:-1] for page in pages)
+        return Serializer().to_json(self.decode(start, stop))
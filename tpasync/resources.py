@@ -1,10 +1,57 @@
-from celery.result import AsyncResult, EagerResult
+import hashlib
+import math
+import re
+import time
+from datetime import datetime
+
+from celery import chord, states, uuid
+from celery.canvas import Signature
+from celery.exceptions import TimeoutError
+from celery.result import AsyncResult, EagerResult, GroupResult
 from django.conf import settings
 from django.conf.urls import url
+from django.core.exceptions import ImproperlyConfigured
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils import timezone
+from django.utils.http import parse_etags, urlencode
+from django.utils.text import compress_sequence, compress_string
 from tastypie import resources, http, utils
+from tastypie.utils.mime import build_content_type
+
+from . import chunks, expiry, rendering, webhooks
+from .backends import RESULT_BACKEND, watch
+from .executors import LocalResult
+from .expiry import EXPIRY_REGISTRY
+from .metrics import METRICS
+from .stats import TASK_STATS
+from .store import LocalStore
+from .tasks import deliver_callback, merge_results, watch_callback
 
 # use for dev/test only!
-EAGER_RESULTS = {}
+EAGER_RESULTS = LocalStore(
+    max_size=getattr(settings, 'TPASYNC_EAGER_RESULTS_MAX_SIZE', 1000),
+    ttl=getattr(settings, 'TPASYNC_EAGER_RESULTS_TTL', 3600))
+
+# task ids of running requests, see AsyncResourceMixin.request_fingerprint
+COALESCED_REQUESTS = LocalStore(max_size=10000)
+# fingerprints of running requests whose results will be cached
+CACHED_REQUESTS = LocalStore(max_size=10000)
+# chunk task ids of fan-out jobs by merge task id, see fan_out
+FAN_OUT_CHUNKS = LocalStore(max_size=10000, ttl=86400)
+# task ids by tag, see AsyncResourceMixin.get_task_tag
+TASK_TAGS = LocalStore(max_size=10000, ttl=86400)
+# ids of tasks with responses in the response cache, see async_result
+RESPONSE_CACHE_INDEX = LocalStore(max_size=10000)
+# states of finished tasks, they don't change anymore
+FINISHED_STATES = LocalStore(
+    max_size=getattr(settings, 'TPASYNC_FINISHED_STATES_MAX_SIZE', 10000))
+# merged results of finished groups, see async_group_result
+GROUP_RESULTS = LocalStore(
+    max_size=getattr(settings, 'TPASYNC_GROUP_RESULTS_MAX_SIZE', 100),
+    ttl=300)
+
+TASK_ID_PATTERN = r'[\w\-]{36}'
 
 
 class AsyncResourceMixin(object):
@@ -44,7 +91,10 @@ class AsyncResourceMixin(object):
         Task state.
 
         If request method is GET, it returns a JSON dict with state. If task
-        has completed, that dict also contains ``result_uri`` entry.
+        has completed, that dict also contains ``result_uri`` entry. Clients
+        can pass ``?wait=<seconds>`` to long-poll: the response is held until
+        the task has finished or the timeout has passed. The timeout is
+        capped by ``Meta.max_state_wait`` (0, the default, disables waiting).
 
         If request method is DELETE and task hasn't run yet, it revokes this
         task. See http://celery.readthedocs.org/en/latest/userguide/workers.html#persistent-revokes
@@ -52,34 +102,290 @@ class AsyncResourceMixin(object):
         revoked (is in progress or finished), we return response with HTTP Bad
         Request state.
 
+        With the ``TPASYNC_TASK_STATS`` setting, unfinished tasks get an
+        ``estimated_completion`` time and a ``Retry-After`` header, based on
+        queue wait and run times of previous tasks (see tpasync.stats).
+
+        Responses to GET carry an ``ETag`` of their body, clients that send
+        it back in ``If-None-Match`` get 304 Not Modified while neither the
+        state nor ``progress`` or ``estimated_completion`` changed.
+        States of finished tasks are remembered in ``FINISHED_STATES``, so
+        they are answered without the result backend.
+
+        Jobs started with ``fan_out`` report the states of their chunks in a
+        ``progress`` dict until they are done.
+
         Other methods are forbidden.
         """
-        if not getattr(settings, 'CELERY_ALWAYS_EAGER'):
-            task = AsyncResult(task_id)
-        else:
-            task = EAGER_RESULTS[task_id]
         if request.method == 'GET':
-            data = {
-                'state': task.state, 'id': task.id,
-                'resource_uri': request.get_full_path()}
-            if task.ready():
-                data['result_uri'] = self._build_reverse_url(
-                    'api_async_result',
-                    kwargs={
-                        'api_name': self._meta.api_name,
-                        'resource_name': self._meta.resource_name,
-                        'task_id': task_id})
-            return self.create_response(request, data)
-        elif request.method == 'DELETE':
-            if not task.ready():
-                try:
-                    task.revoke(terminate=True)
+            metrics = self._metrics()
+            state = FINISHED_STATES.get(task_id)
+            if state is None:
+                task = self._get_task(task_id)
+                if task is None:
+                    return http.HttpNotFound()
+                state = self._wait_for_task(request, task)
+                self._cache_result(task)
+                if state is None:
+                    with metrics.timer(
+                            'tpasync_backend_seconds', view='state',
+                            resource=self._meta.resource_name):
+                        state = self._get_state(task)
+                if state in states.READY_STATES:
+                    FINISHED_STATES.set(task_id, state)
+            metrics.increment(
+                'tpasync_states_total', state=state,
+                resource=self._meta.resource_name)
+            data = self._state_data(
+                task_id, state, resource_uri=request.get_full_path())
+            if state not in states.READY_STATES:
+                chunk_ids = getattr(
+                    self._meta, 'fan_out_store', FAN_OUT_CHUNKS).get(task_id)
+                if chunk_ids:
+                    data['progress'] = self._count_states(
+                        self._result_backend().get_states(
+                            chunk_ids).values())
+            completion = self._estimate(task_id, state)
+            if completion is not None:
+                # Whole seconds, polls get the same body (and ETag)
+                data['estimated_completion'] = datetime.fromtimestamp(
+                    round(completion),
+                    timezone.utc if settings.USE_TZ else None)
+            response = self.create_response(request, data)
+            # The body has more than the state (progress, estimates)
+            etag = hashlib.sha1(response.content).hexdigest()
+            if self._not_modified(request, etag):
+                response = http.HttpNotModified()
+            response['ETag'] = '"%s"' % etag
+            self._retry_after(response, completion)
+            return response
+        task = self._get_task(task_id)
+        if task is None:
+            return http.HttpNotFound()
+        if request.method == 'DELETE':
+            if getattr(self._meta, 'executor', None) is not None:
+                data = self._revoke([task_id])
+                if data['revoked']:
                     return http.HttpGone()
-                except:
-                    pass
-            return http.HttpBadRequest()
+            elif not task.ready():
+                # Unlike bulk revocation, running tasks are terminated
+                task.revoke(terminate=True)
+                return http.HttpGone()
+            else:
+                data = dict(self._revoke_report(), finished=[task_id])
+            return self.create_response(
+                request, data, response_class=http.HttpBadRequest)
+        else:
+            return http.HttpForbidden()
+
+    def async_events(self, request, task_id, **kwargs):
+        """
+        Task state as a stream of server-sent events.
+
+        Sends a ``state`` event with the same data as ``async_state`` every
+        time the task state or its ``meta`` changes, with task ``meta`` for
+        custom states (like progress reported with ``update_state``). The
+        stream ends when the task is ready or after ``Meta.events_timeout``
+        seconds (300 by default), clients are expected to reconnect then.
+        Intermediate states are checked every ``Meta.events_interval``
+        seconds (1 by default), a comment is sent to keep the connection
+        alive if nothing changed. With ``Meta.state_watcher``, states come
+        from the shared poller (see tpasync.watcher), the meta of custom
+        states is still read once per interval.
+
+        If task doesn't exist, return Http 404 Not Found. Other methods are
+        forbidden.
+        """
+        if request.method != 'GET':
+            return http.HttpForbidden()
+        task = self._get_task(task_id)
+        if task is None:
+            return http.HttpNotFound()
+        serializer = self._meta.serializer
+        timeout = getattr(self._meta, 'events_timeout', 300)
+        interval = getattr(self._meta, 'events_interval', 1)
+        watcher = getattr(self._meta, 'state_watcher', None)
+        polled = watcher is not None and watcher.watches(task)
+        if polled:
+            changes = watcher.watch(task_id, timeout, interval)
+        else:
+            changes = watch(task, timeout, interval)
+
+        def stream():
+            yield 'retry: 1000\n\n'
+            sent = None
+            for i, state in enumerate(changes):
+                # The poller only reports new states, progress can change
+                # the meta of custom states alone
+                if state is None and polled and sent is not None and \
+                        sent[0] not in states.ALL_STATES:
+                    state = sent[0]
+                info = None
+                if state is not None and state not in states.READY_STATES:
+                    info = task.info
+                if state is None or (state, info) == sent:
+                    yield ': keep-alive\n\n'
+                    continue
+                sent = (state, info)
+                data = self._state_data(task_id, state)
+                if isinstance(info, dict):
+                    data['meta'] = info
+                yield 'id: %d\nevent: state\ndata: %s\n\n' % (
+                    i, serializer.to_json(data))
+
+        response = StreamingHttpResponse(
+            stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Tell nginx not to buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def async_state_list(self, request, **kwargs):
+        """
+        State of many tasks at once.
+
+        Task ids are passed as comma separated ``ids`` GET parameter, or for
+        POST requests as a serialized list (or a dict with ``ids`` entry) in
+        the request body. Returns a list of dicts like the ones from
+        ``async_state``. No more than ``Meta.max_limit`` tasks (unless it's
+        0) can be queried in one request.
+
+        DELETE revokes many tasks at once: those in ``ids``, the tasks of
+        the group given as ``group`` or those submitted with the tag given
+        as ``tag`` (see ``get_task_tag``). Tasks that haven't started are
+        revoked with a single broadcast. The response lists the ids of
+        ``revoked`` tasks, of ``running`` ones, which are left alone, and
+        of ``finished`` ones (including tasks revoked before). Unless the
+        celery app has ``CELERY_TRACK_STARTED`` set, running tasks report
+        ``PENDING`` too, so the revocation of pending tasks is only
+        ``requested``: those that were running anyway finish.
+
+        Other methods are forbidden.
+        """
+        if request.method == 'DELETE':
+            return self._revoke_tasks(request)
+        if request.method == 'GET':
+            task_ids = request.GET.get('ids', '').split(',')
+        elif request.method == 'POST':
+            task_ids = self.deserialize(
+                request, request.body,
+                format=request.META.get('CONTENT_TYPE', 'application/json'))
+            if isinstance(task_ids, dict):
+                task_ids = task_ids.get('ids', [])
         else:
             return http.HttpForbidden()
+        if not isinstance(task_ids, list):
+            return http.HttpBadRequest()
+        task_ids = [task_id for task_id in task_ids if task_id]
+        # A max_limit of 0 means no limit, like for tastypie's paginator
+        if not task_ids or self._meta.max_limit and \
+                len(task_ids) > self._meta.max_limit:
+            return http.HttpBadRequest()
+        for task_id in task_ids:
+            if not isinstance(task_id, basestring) or \
+                    not re.match(r'^%s$' % TASK_ID_PATTERN, task_id):
+                return http.HttpBadRequest()
+
+        found = self._get_states(task_ids)
+        data = {
+            self._meta.collection_name: [
+                self._state_data(task_id, found[task_id])
+                for task_id in task_ids]}
+        return self.create_response(request, data)
+
+    def _get_states(self, task_ids):
+        if not getattr(settings, 'CELERY_ALWAYS_EAGER') and \
+                getattr(self._meta, 'executor', None) is None:
+            return self._result_backend().get_states(task_ids)
+        found = {}
+        for task_id in task_ids:
+            task = self._get_task(task_id)
+            found[task_id] = task.state if task else states.PENDING
+        return found
+
+    def _revoke_tasks(self, request):
+        """
+        Bulk revocation, see ``async_state_list``.
+        """
+        if request.GET.get('group'):
+            group = self._get_group(request.GET['group'])
+            if group is None:
+                return http.HttpNotFound()
+            task_ids = [child.id for child in group.results]
+        elif request.GET.get('tag'):
+            store = getattr(self._meta, 'tag_store', TASK_TAGS)
+            task_ids = store.get_list(self._tag_key(request.GET['tag']))
+        else:
+            task_ids = [
+                task_id for task_id in request.GET.get('ids', '').split(',')
+                if task_id]
+            if not task_ids:
+                return http.HttpBadRequest()
+            for task_id in task_ids:
+                if not re.match(r'^%s$' % TASK_ID_PATTERN, task_id):
+                    return http.HttpBadRequest()
+        return self.create_response(request, self._revoke(task_ids))
+
+    def _revoke_report(self):
+        return {'revoked': [], 'requested': [], 'running': [], 'finished': []}
+
+    def _revoke(self, task_ids):
+        """
+        Revoke the tasks of ``task_ids`` that didn't start yet.
+
+        Returns their ids under ``revoked``, or ``requested`` if they may
+        have started without reporting it, and the others under ``running``
+        or ``finished``. Running tasks are not terminated.
+        """
+        found = self._get_states(task_ids)
+        data = self._revoke_report()
+        for task_id in task_ids:
+            state = found[task_id]
+            if state in states.READY_STATES:
+                data['finished'].append(task_id)
+            elif state in (states.PENDING, states.RECEIVED):
+                data['revoked'].append(task_id)
+            else:
+                data['running'].append(task_id)
+        executor = getattr(self._meta, 'executor', None)
+        if executor is not None:
+            for task_id in list(data['revoked']):
+                # Executors can't revoke tasks that started meanwhile
+                if not executor.revoke(task_id):
+                    data['revoked'].remove(task_id)
+                    data['running'].append(task_id)
+        elif data['revoked'] and \
+                not getattr(settings, 'CELERY_ALWAYS_EAGER'):
+            app = self._result_backend().app
+            app.control.revoke(data['revoked'])
+            # Without started states, PENDING tasks may be running
+            if not app.conf.CELERY_TRACK_STARTED:
+                data['requested'], data['revoked'] = data['revoked'], []
+        return data
+
+    def get_task_tag(self, request):
+        """
+        Tag of the tasks submitted by ``request``, or None.
+
+        This is the ``tag`` GET parameter. Tagged tasks can be revoked
+        together, see ``async_state_list``. Override this to scope tags,
+        e.g. by user.
+        """
+        return request.GET.get('tag') or None
+
+    def _tag_key(self, tag):
+        return '%s:%s' % (self._meta.resource_name, tag)
+
+    def _tag_tasks(self, request, task_ids):
+        """
+        Record ``task_ids`` under the tag of ``request`` in
+        ``Meta.tag_store``.
+        """
+        tag = self.get_task_tag(request)
+        if tag is None:
+            return
+        getattr(self._meta, 'tag_store', TASK_TAGS).append(
+            self._tag_key(tag), list(task_ids))
 
     def async_result(self, request, task_id, **kwargs):
         """
@@ -89,56 +395,709 @@ class AsyncResourceMixin(object):
 
         If request is not ready (or doesn't exist - we can't tell this),
         return Http 404 Not Found.
+
+        Results of successful tasks never change, their responses get an
+        ``ETag`` and an immutable ``Cache-Control`` header (with
+        ``Meta.result_max_age`` seconds, one day by default). It is
+        ``private`` unless ``Meta.result_cache_public`` is set. Set
+        ``Meta.response_cache`` to a store to keep serialized responses, by
+        task, format and query parameters. Tasks with cached responses are
+        kept in ``Meta.response_cache_index``, which has to be shared
+        between processes if the cache is. Clients that send the ``ETag``
+        back in ``If-None-Match`` get 304 Not Modified, without the result
+        being fetched again.
+
+        With ``Meta.stream_results`` set, list results in JSON format are
+        streamed, objects are dehydrated and serialized one at a time. Use
+        it with ``Meta.max_limit = 0`` to let clients fetch all results with
+        ``?limit=0``.
+
+        DELETE forgets the result of a finished task: it's deleted from the
+        result backend, with its chunks, its cached responses are dropped,
+        and later requests get 404 (see tpasync.expiry). Unfinished tasks
+        can't be forgotten, that's a 400 Bad Request.
+
+        With ``Meta.partial_results``, tasks that write their list result
+        while they run (see ``tpasync.tasks.partial``) get the objects
+        written so far instead of 404, paginated as usual and with
+        ``incomplete`` set in ``meta``. These responses aren't cached.
+
+        Results rendered on the worker (see tpasync.rendering) are returned
+        as they are, ``process_result`` isn't applied to them. Of chunked
+        list results (see tpasync.chunks), only the chunks of the requested
+        page are read.
+
+        With ``Meta.compress_results``, responses of at least
+        ``Meta.compress_min_size`` bytes (200 by default) are gzipped for
+        clients that accept it, streamed responses chunk by chunk. Their
+        ``ETag`` is weak, as the bytes differ from the uncompressed
+        response.
         """
-        # hack to allow local testing
-        if not getattr(settings, 'CELERY_ALWAYS_EAGER'):
-            task = AsyncResult(task_id)
+        if request.method == 'DELETE':
+            return self._forget_result(task_id)
+        return self._compress(request, self._async_result(request, task_id))
+
+    def _forget_result(self, task_id):
+        task = self._get_task(task_id)
+        if task is None:
+            return http.HttpNotFound()
+        if not task.ready():
+            return http.HttpBadRequest()
+        expiry.forget(task, getattr(self._meta, 'chunk_store', None))
+        for store in (EAGER_RESULTS, FINISHED_STATES, getattr(
+                self._meta, 'fan_out_store', FAN_OUT_CHUNKS),
+                self._response_cache_index()):
+            store.delete(task_id)
+        EXPIRY_REGISTRY.remove(task_id)
+        return http.HttpNoContent()
+
+    def _result_ttl(self):
+        """
+        ``Meta.result_ttl``, if the sweeper can forget results of this
+        resource.
+
+        The sweeper runs without resources, it only knows the default
+        result backend, chunk store and response cache index.
+        """
+        ttl = getattr(self._meta, 'result_ttl', None)
+        if ttl and (
+                self._result_backend() is not RESULT_BACKEND or
+                getattr(self._meta, 'chunk_store', None) is not None or
+                getattr(self._meta, 'executor', None) is not None or
+                self._response_cache_index() is not RESPONSE_CACHE_INDEX):
+            raise ImproperlyConfigured(
+                'Meta.result_ttl of %s requires the default result backend, '
+                'chunk store and response cache index, and no executor' %
+                self._meta.resource_name)
+        return ttl
+
+    def _response_cache_index(self):
+        return getattr(
+            self._meta, 'response_cache_index', RESPONSE_CACHE_INDEX)
+
+    def _async_result(self, request, task_id):
+        key = self._response_key(request, task_id)
+        cache = getattr(self._meta, 'response_cache', None)
+        finished = FINISHED_STATES.get(task_id) == states.SUCCESS
+        if finished:
+            response = self._cached_response(request, task_id, key, cache)
+            if response is not None:
+                return response
+        task = self._get_task(task_id)
+        if task is None:
+            return http.HttpNotFound()
+        if not task.ready():
+            return self._partial_response(request, task_id)
+        FINISHED_STATES.set(task_id, task.state)
+        self._cache_result(task)
+        successful = task.state == states.SUCCESS
+        if successful and not finished:
+            response = self._cached_response(request, task_id, key, cache)
+            if response is not None:
+                return response
+        metrics = self._metrics()
+        try:
+            with metrics.timer(
+                    'tpasync_backend_seconds', view='result',
+                    resource=self._meta.resource_name):
+                result = task.get()
+            result = self._process_result(result)
+        except Exception, error:
+            result = {'error': unicode(error)}
+        try:
+            response = self._result_response(request, result)
+        except chunks.ChunksExpired:
+            return http.HttpNotFound()
+        if metrics.enabled and not response.streaming:
+            metrics.observe(
+                'tpasync_response_bytes', len(response.content),
+                resource=self._meta.resource_name)
+        if successful and response.status_code == 200:
+            if cache is not None and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']))
+                self._response_cache_index().set(task_id, True)
+            self._immutable(response, key)
+        return response
+
+    def _partial_response(self, request, task_id):
+        """
+        Chunks of a running task written so far, see ``Meta.partial_results``.
+        """
+        if not getattr(self._meta, 'partial_results', False):
+            return http.HttpNotFound()
+        store = getattr(self._meta, 'chunk_store', None)
+        reference = chunks.read_partial(task_id, store)
+        if reference is None:
+            return http.HttpNotFound()
+        try:
+            response = self._list_response(
+                request, chunks.ChunkedList(reference, store),
+                incomplete=True)
+        except chunks.ChunksExpired:
+            return http.HttpNotFound()
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    def _compress(self, request, response):
+        """
+        Gzip a result response, see ``Meta.compress_results``.
+        """
+        if not getattr(self._meta, 'compress_results', False) or \
+                response.status_code not in (200, 304) or \
+                response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if not re.search(
+                r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+        if response.status_code == 200:
+            if response.streaming:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content)
+            else:
+                if len(response.content) < getattr(
+                        self._meta, 'compress_min_size', 200):
+                    return response
+                compressed = compress_string(response.content)
+                if len(compressed) >= len(response.content):
+                    return response
+                response.content = compressed
+                response['Content-Length'] = str(len(compressed))
+            response['Content-Encoding'] = 'gzip'
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+    def _metrics(self):
+        return getattr(self._meta, 'metrics', METRICS)
+
+    def _result_backend(self):
+        return getattr(self._meta, 'result_backend', RESULT_BACKEND)
+
+    def _count_states(self, found):
+        completed = found.count(states.SUCCESS)
+        failed = len([
+            state for state in found if state in states.PROPAGATE_STATES])
+        return {
+            'total': len(found), 'completed': completed, 'failed': failed,
+            'pending': len(found) - completed - failed}
+
+    def _get_state(self, task):
+        """
+        State of ``task``, without fetching its result if the backend allows.
+        """
+        result_backend = self._result_backend()
+        if task.backend is not None and \
+                task.backend is result_backend.backend:
+            return result_backend.get_state(task.id)
+        return task.state
+
+    def _response_key(self, request, task_id):
+        """
+        Key of a result response, used as cache key and ETag.
+        """
+        return hashlib.sha1('\n'.join((
+            task_id, self.determine_format(request),
+            urlencode(sorted(request.GET.lists()), doseq=True)))).hexdigest()
+
+    def _cached_response(self, request, task_id, key, cache):
+        """
+        304 or cached response for a successful task, or None.
+
+        Responses of forgotten tasks are not in the index anymore.
+        """
+        if self._not_modified(request, key):
+            return self._immutable(http.HttpNotModified(), key)
+        cached = None
+        if cache is not None and self._response_cache_index().get(task_id):
+            cached = cache.get(key)
+        if cached is not None:
+            return self._immutable(
+                http.HttpResponse(cached[0], content_type=cached[1]), key)
+
+    def _not_modified(self, request, etag):
+        """
+        Whether ``If-None-Match`` of ``request`` matches ``etag``.
+        """
+        header = request.META.get('HTTP_IF_NONE_MATCH')
+        if not header:
+            return False
+        etags = parse_etags(header)
+        return '*' in etags or etag in etags
+
+    def _immutable(self, response, key):
+        response['ETag'] = '"%s"' % key
+        # Results may be private to the user, shared caches only keep them
+        # if the resource says so
+        if getattr(self._meta, 'result_cache_public', False):
+            patch_cache_control(response, public=True)
         else:
-            task = EAGER_RESULTS[task_id]
-        if task.ready():
-            try:
-                result = self.process_result(task.get())
-            except Exception, error:
-                result = {'error': unicode(error)}
+            patch_cache_control(response, private=True)
+        patch_cache_control(
+            response, immutable=True,
+            max_age=getattr(self._meta, 'result_max_age', 86400))
+        # The format is negotiated
+        patch_vary_headers(response, ('Accept',))
+        return response
 
-            if isinstance(result, http.HttpResponse):
-                return result
-            elif isinstance(result, basestring):
-                return http.HttpResponse(result)
-            elif isinstance(result, list):
-                objects = result
-                sorted_objects = self.apply_sorting(
-                    objects, options=request.GET)
-
-                paginator = self._meta.paginator_class(
-                    request.GET, sorted_objects,
-                    resource_uri=self.get_resource_uri(),
-                    limit=self._meta.limit, max_limit=self._meta.max_limit,
-                    collection_name=self._meta.collection_name)
-                to_be_serialized = paginator.page()
-
-                # Dehydrate the bundles in preparation for serialization.
-                bundles = []
-
-                for obj in to_be_serialized[self._meta.collection_name]:
-                    bundle = self.build_bundle(obj=obj, request=request)
-                    bundles.append(self.full_dehydrate(bundle, for_list=True))
-
-                to_be_serialized[self._meta.collection_name] = bundles
-                to_be_serialized = self.alter_list_data_to_serialize(
-                    request, to_be_serialized)
-                return self.create_response(request, to_be_serialized)
-            elif isinstance(result, dict):
-                bundle = self.build_bundle(obj=result, request=request)
+    def _result_response(self, request, result):
+        """
+        Serialize a processed task result.
+        """
+        if isinstance(result, http.HttpResponse):
+            return result
+        elif rendering.is_rendered(result):
+            return self._rendered_response(request, result)
+        elif isinstance(result, basestring):
+            return http.HttpResponse(result)
+        elif isinstance(result, (list, chunks.ChunkedList)):
+            return self._list_response(request, result)
+        metrics = self._metrics()
+        resource_name = self._meta.resource_name
+        with metrics.timer(
+                'tpasync_dehydrate_seconds', resource=resource_name):
+            bundle = self.build_bundle(obj=result, request=request)
+            if isinstance(result, dict):
                 self.full_dehydrate(bundle)
-                return self.create_response(request, bundle)
             else:
-                bundle = self.build_bundle(obj=result, request=request)
                 bundle = self.full_dehydrate(bundle)
                 bundle = self.alter_detail_data_to_serialize(request, bundle)
-                return self.create_response(request, bundle)
+        with metrics.timer(
+                'tpasync_serialize_seconds', resource=resource_name):
+            return self.create_response(request, bundle)
+
+    def _rendered_response(self, request, rendered):
+        """
+        Response for a result rendered on the worker (see tpasync.rendering).
+
+        Rendered pages are paginated like other list results, the page is
+        put into the response without being decoded if it is aligned to the
+        rendered pages.
+        """
+        if self.determine_format(request) != 'application/json':
+            return self._result_response(request, rendering.decode(rendered))
+        content_type = build_content_type('application/json')
+        if 'pages' not in rendered:
+            # Lists rendered as a whole by older versions
+            if rendered['content'].startswith('['):
+                return self._list_response(
+                    request, rendering.decode(rendered))
+            return http.HttpResponse(
+                rendered['content'], content_type=content_type)
+        paginator = self._meta.paginator_class(
+            request.GET, rendering.RenderedPages(rendered),
+            resource_uri=self.get_resource_uri(),
+            limit=self._meta.limit, max_limit=self._meta.max_limit,
+            collection_name=self._meta.collection_name)
+        page = paginator.page()
+        return http.HttpResponse(
+            u'{"%s": %s, "meta": %s}' % (
+                self._meta.collection_name,
+                page[self._meta.collection_name],
+                self.serialize(request, page['meta'], 'application/json')),
+            content_type=content_type)
+
+    def _accepted(self, task_id, url_name='api_async_state',
+                  id_name='task_id'):
+        response = http.HttpAccepted()
+        response['Location'] = self._task_uri(url_name, task_id, id_name)
+        return response
+
+    def _estimate(self, task_id, state):
+        """
+        Timestamp when an unfinished task is expected to be done, or None.
+        """
+        if getattr(settings, 'TPASYNC_TASK_STATS', False) and \
+                state not in states.READY_STATES:
+            return TASK_STATS.completion(task_id, state)
+
+    def _retry_after(self, response, completion):
+        if completion is not None:
+            seconds = completion - TASK_STATS.timer()
+            response['Retry-After'] = str(int(math.ceil(max(seconds, 1))))
+
+    def _task_uri(self, url_name, task_id, id_name='task_id'):
+        return self._build_reverse_url(
+            url_name,
+            kwargs={
+                'api_name': self._meta.api_name,
+                'resource_name': self._meta.resource_name,
+                id_name: task_id})
+
+    def _state_data(self, task_id, state, resource_uri=None):
+        """
+        Data returned for a task by the state views.
+        """
+        data = {
+            'state': state, 'id': task_id,
+            'resource_uri': (
+                resource_uri or self._task_uri('api_async_state', task_id))}
+        if state in states.READY_STATES:
+            data['result_uri'] = self._task_uri('api_async_result', task_id)
+        return data
+
+    def _wait_for_task(self, request, task):
+        """
+        Block until ``task`` is ready or ``?wait`` seconds have passed.
+
+        Waiting is delegated to the result backend, so backends that push
+        results (like ``amqp``) are not polled. The message is not acked,
+        other clients can still read the state. Returns the state if the
+        task finished while waiting. With ``Meta.state_watcher``, waits
+        on the shared poller instead (see tpasync.watcher).
+        """
+        try:
+            wait = float(request.GET.get('wait', 0))
+        except ValueError:
+            return
+        wait = min(wait, getattr(self._meta, 'max_state_wait', 0))
+        watcher = getattr(self._meta, 'state_watcher', None)
+        if wait > 0 and watcher is not None and watcher.watches(task):
+            return watcher.wait_ready(task.id, wait)
+        if wait > 0 and not task.ready():
+            try:
+                task.get(timeout=wait, propagate=False, no_ack=False)
+            except TimeoutError:
+                return
+            return task.state
+
+    def async_group_state(self, request, group_id, **kwargs):
+        """
+        Group state.
+
+        Returns a JSON dict with the number of ``total``, ``completed``,
+        ``failed`` and ``pending`` tasks in the group. Once all tasks are
+        ready, ``state`` becomes ``SUCCESS`` (or ``FAILURE`` if any of them
+        failed) and the dict also contains ``result_uri`` entry.
+
+        If group doesn't exist, return Http 404 Not Found. Other methods are
+        forbidden.
+        """
+        if request.method != 'GET':
+            return http.HttpForbidden()
+        group = self._get_group(group_id)
+        if group is None:
+            return http.HttpNotFound()
+        task_ids = [child.id for child in group.results]
+        if not getattr(settings, 'CELERY_ALWAYS_EAGER'):
+            found = self._result_backend().get_states(task_ids).values()
+        else:
+            found = [child.state for child in group.results]
+        data = self._count_states(found)
+        data.update(id=group_id, resource_uri=request.get_full_path())
+        if data['pending']:
+            data['state'] = states.PENDING
+        else:
+            data['state'] = states.FAILURE if data['failed'] else \
+                states.SUCCESS
+            data['result_uri'] = self._task_uri(
+                'api_async_group_result', group_id, id_name='group_id')
+        return self.create_response(request, data)
+
+    def async_group_result(self, request, group_id, **kwargs):
+        """
+        Group results.
+
+        If all tasks in the group are ready, return Http 200 response with
+        their results merged into a single paginated list: list results are
+        concatenated, other results are appended. Failed tasks contribute a
+        dict with ``error`` entry.
+
+        If group is not ready (or doesn't exist, or chunks of its results
+        expired), return Http 404 Not Found.
+
+        The merged list is kept in ``Meta.group_result_store`` (a LocalStore
+        by default), so following pages don't read all results again.
+        """
+        store = getattr(self._meta, 'group_result_store', GROUP_RESULTS)
+        objects = store.get(group_id)
+        if objects is not None:
+            return self._list_response(request, objects)
+        group = self._get_group(group_id)
+        if group is None:
+            return http.HttpNotFound()
+        task_ids = [child.id for child in group.results]
+        if not getattr(settings, 'CELERY_ALWAYS_EAGER'):
+            found = self._result_backend().get_states(task_ids).values()
         else:
+            found = [child.state for child in group.results]
+        if self._count_states(found)['pending']:
             return http.HttpNotFound()
+        if not getattr(settings, 'CELERY_ALWAYS_EAGER'):
+            found = self._result_backend().get_results(task_ids)
+            results = [found[task_id] for task_id in task_ids]
+        else:
+            results = [child.result for child in group.results]
+        objects = []
+        for result in results:
+            if rendering.is_rendered(result):
+                result = rendering.decode(result)
+            elif chunks.is_chunked(result):
+                try:
+                    result = list(chunks.ChunkedList(
+                        result, getattr(self._meta, 'chunk_store', None)))
+                except chunks.ChunksExpired:
+                    return http.HttpNotFound()
+            if isinstance(result, Exception):
+                objects.append({'error': unicode(result)})
+            elif isinstance(result, list):
+                objects.extend(result)
+            else:
+                objects.append(result)
+        store.set(group_id, objects)
+        return self._list_response(request, objects)
+
+    def _get_task(self, task_id):
+        """
+        Return the result for ``task_id``.
+
+        In eager mode results are taken from ``EAGER_RESULTS``, with
+        ``Meta.executor`` from the executor. Returns None if the result is
+        not there (anymore).
+        """
+        executor = getattr(self._meta, 'executor', None)
+        if executor is not None:
+            return executor.get_result(task_id)
+        # hack to allow local testing
+        if not getattr(settings, 'CELERY_ALWAYS_EAGER'):
+            return self._result_backend().result(task_id)
+        else:
+            return EAGER_RESULTS.get(task_id)
+
+    def _get_group(self, group_id):
+        if not getattr(settings, 'CELERY_ALWAYS_EAGER'):
+            return self._result_backend().group(group_id)
+        else:
+            return EAGER_RESULTS.get(group_id)
+
+    def _list_response(self, request, objects, incomplete=False):
+        """
+        Sort, paginate and serialize a list of results.
+
+        ``incomplete`` is added to the page's ``meta`` if set. Streamed pages
+        of chunked results read their chunks while they are sent.
+        """
+        metrics = self._metrics()
+        resource_name = self._meta.resource_name
+        streaming = getattr(self._meta, 'stream_results', False) and \
+            self.determine_format(request) == 'application/json'
+        if streaming and isinstance(objects, chunks.ChunkedList):
+            objects = objects.lazy()
+        with metrics.timer(
+                'tpasync_paginate_seconds', resource=resource_name):
+            sorted_objects = self.apply_sorting(objects, options=request.GET)
+
+            paginator = self._meta.paginator_class(
+                request.GET, sorted_objects,
+                resource_uri=self.get_resource_uri(),
+                limit=self._meta.limit, max_limit=self._meta.max_limit,
+                collection_name=self._meta.collection_name)
+            to_be_serialized = paginator.page()
+        if incomplete:
+            to_be_serialized['meta']['incomplete'] = True
+
+        if streaming:
+            return self._streaming_list_response(request, to_be_serialized)
+
+        # Dehydrate the bundles in preparation for serialization.
+        bundles = []
+
+        with metrics.timer(
+                'tpasync_dehydrate_seconds', resource=resource_name):
+            for obj in to_be_serialized[self._meta.collection_name]:
+                bundle = self.build_bundle(obj=obj, request=request)
+                bundles.append(self.full_dehydrate(bundle, for_list=True))
+
+        to_be_serialized[self._meta.collection_name] = bundles
+        to_be_serialized = self.alter_list_data_to_serialize(
+            request, to_be_serialized)
+        with metrics.timer(
+                'tpasync_serialize_seconds', resource=resource_name):
+            return self.create_response(request, to_be_serialized)
+
+    def request_fingerprint(self, request, method, **kwargs):
+        """
+        Identify a request for ``Meta.coalesce_requests``.
+
+        Requests with the same resource, method, URL kwargs, query and body
+        get the same fingerprint. Override this to add more, e.g. the user if
+        results must not be shared between users.
+        """
+        fingerprint = hashlib.sha1('\n'.join((
+            self._meta.resource_name, method,
+            urlencode(sorted(kwargs.items())),
+            urlencode(sorted(request.GET.lists()), doseq=True), '')))
+        fingerprint.update(request.body)
+        return fingerprint.hexdigest()
+
+    def invalidate_cached_result(self, request, method, **kwargs):
+        """
+        Drop the cached result for a request, see ``Meta.result_cache``.
+
+        Takes the same arguments as ``request_fingerprint``.
+        """
+        cache = getattr(self._meta, 'result_cache', None)
+        if cache is not None:
+            cache.delete(self.request_fingerprint(request, method, **kwargs))
+
+    def _cache_result(self, task):
+        """
+        Put the result of a successful task into ``Meta.result_cache``.
+
+        Only tasks started by a cacheable request are cached, their
+        fingerprints are kept in ``Meta.result_cache_index``.
+        """
+        cache = getattr(self._meta, 'result_cache', None)
+        if cache is None or task.state != states.SUCCESS:
+            return
+        index = getattr(self._meta, 'result_cache_index', CACHED_REQUESTS)
+        fingerprint = index.get(task.id)
+        if fingerprint is not None:
+            cache.set(
+                fingerprint, task.result,
+                ttl=getattr(self._meta, 'result_cache_ttl', None))
+            index.delete(task.id)
+
+    def _get_coalesced_task(self, fingerprint):
+        """
+        Return the id of the unfinished task started for ``fingerprint``.
+        """
+        task_id = getattr(
+            self._meta, 'coalesce_store', COALESCED_REQUESTS).get(fingerprint)
+        if task_id is not None:
+            task = self._get_task(task_id)
+            if task is not None and task.state not in states.READY_STATES:
+                return task_id
+
+    def _streaming_list_response(self, request, to_be_serialized):
+        """
+        Stream a page of results as JSON, dehydrating objects one by one.
+
+        ``alter_list_data_to_serialize`` gets the page without objects.
+        """
+        objects = to_be_serialized[self._meta.collection_name]
+        to_be_serialized[self._meta.collection_name] = []
+        to_be_serialized = self.alter_list_data_to_serialize(
+            request, to_be_serialized)
+        del to_be_serialized[self._meta.collection_name]
+        serializer = self._meta.serializer
+
+        def stream():
+            # Everything but the objects, without the closing brace
+            head = serializer.to_json(to_be_serialized)[:-1]
+            if to_be_serialized:
+                head += ', '
+            yield head + serializer.to_json(self._meta.collection_name) + ': ['
+            separator, chunk = '', []
+            for obj in objects:
+                bundle = self.build_bundle(obj=obj, request=request)
+                bundle = self.full_dehydrate(bundle, for_list=True)
+                chunk.append(serializer.to_json(bundle))
+                if len(chunk) == 100:
+                    yield separator + ', '.join(chunk)
+                    separator, chunk = ', ', []
+            if chunk:
+                yield separator + ', '.join(chunk)
+            yield ']}'
+
+        return StreamingHttpResponse(
+            stream(), content_type=build_content_type('application/json'))
+
+    def get_callback_url(self, request):
+        """
+        URL to POST to when the task of ``request`` has finished, or None.
+
+        This is ``Meta.callback_url``, or the ``callback_url`` GET parameter
+        if ``Meta.allow_callback_url`` is set.
+        """
+        if getattr(self._meta, 'allow_callback_url', False) and \
+                request.GET.get('callback_url'):
+            return request.GET['callback_url']
+        return getattr(self._meta, 'callback_url', None)
+
+    def _callback_data(self, request, task_id, state):
+        return {
+            'id': task_id, 'state': state,
+            'resource_uri': request.build_absolute_uri(
+                self._task_uri('api_async_state', task_id)),
+            'result_uri': request.build_absolute_uri(
+                self._task_uri('api_async_result', task_id))}
+
+    def _link_callback(self, request, signature, callback_url):
+        """
+        Add completion callbacks to a signature that wasn't sent yet.
+        """
+        task_id = signature.freeze().id
+        include_result = getattr(self._meta, 'callback_include_result', False)
+        for link, state in ((signature.link, states.SUCCESS),
+                            (signature.link_error, states.FAILURE)):
+            link(deliver_callback.s(
+                callback_url, self._callback_data(request, task_id, state),
+                include_result).set(**webhooks.task_options()))
+
+    def _watch_callback(self, request, task, callback_url):
+        """
+        Deliver completion callback of a task that was sent without one.
+
+        Tasks run by ``Meta.executor`` are delivered once the executor
+        finished them. Others are watched by a ``watch_callback`` task sent
+        with the app of ``Meta.result_backend``, so it reads their state
+        from the same backend.
+        """
+        include_result = getattr(self._meta, 'callback_include_result', False)
+        data = self._callback_data(request, task.id, task.state)
+        # Executors call back from their own thread, whose current app may
+        # differ
+        deliver_task = deliver_callback._get_current_object()
+
+        def deliver(task):
+            value = task.result if task.successful() else task.id
+            deliver_task.apply_async(
+                (value, callback_url, dict(data, state=task.state),
+                 include_result),
+                **webhooks.task_options())
+
+        if isinstance(task, EagerResult):
+            deliver(task)
+        elif isinstance(task, LocalResult):
+            task.executor.add_done_callback(task.id, deliver)
+        else:
+            app = self._result_backend().app
+            app.tasks[watch_callback.name].apply_async(
+                (task.id, callback_url, data, include_result),
+                countdown=getattr(
+                    settings, 'TPASYNC_WEBHOOK_POLL_INTERVAL', 5),
+                **webhooks.task_options())
+
+    def fan_out(self, task, items, chunk_size=None, merge=None):
+        """
+        Run ``task`` on chunks of ``items`` in parallel, as a chord.
+
+        ``task`` (a task or signature) gets a list of at most ``chunk_size``
+        items (``Meta.fan_out_chunk_size``, 1000 by default) as first
+        argument. ``merge`` (``tpasync.tasks.merge_results`` by default)
+        gets the list of chunk results, the default concatenates them.
+        Returns the result of the merge task, for async_* hooks to return.
+
+        Chunk task ids are kept in ``Meta.fan_out_store`` (a LocalStore by
+        default, use a CacheStore to share them between processes), for
+        the state view to report progress. Chords need a result backend
+        that supports them.
+        """
+        chunk_size = chunk_size or getattr(
+            self._meta, 'fan_out_chunk_size', 1000)
+        if not isinstance(task, Signature):
+            task = task.s()
+        items = list(items)
+        header = [
+            task.clone(args=(items[i:i + chunk_size],), task_id=uuid())
+            for i in range(0, len(items), chunk_size)]
+        result = chord(header, merge or merge_results.s()).apply_async()
+        if not isinstance(result, EagerResult):
+            getattr(self._meta, 'fan_out_store', FAN_OUT_CHUNKS).set(
+                result.id, [chunk.options['task_id'] for chunk in header])
+        return result
 
     def process_result(self, result):
         """
@@ -146,6 +1105,20 @@ class AsyncResourceMixin(object):
         """
         return result
 
+    def _process_result(self, result):
+        """
+        Call ``process_result``, except for results rendered on the worker.
+
+        Chunked results are passed as ``ChunkedList`` (see tpasync.chunks),
+        read from ``Meta.chunk_store`` (``TPASYNC_CHUNK_STORE`` by default).
+        """
+        if rendering.is_rendered(result):
+            return result
+        if chunks.is_chunked(result):
+            result = chunks.ChunkedList(
+                result, getattr(self._meta, 'chunk_store', None))
+        return self.process_result(result)
+
     def dehydrate(self, bundle):
         if bundle.obj:
             bundle.data = bundle.obj
@@ -154,13 +1127,37 @@ class AsyncResourceMixin(object):
     def prepend_urls(self):
         return [
             url(
-                r"^(?P<resource_name>%s)/state/(?P<task_id>[\w\-]{36})%s$" % (
+                r"^(?P<resource_name>%s)/state%s$" % (
                     self._meta.resource_name, utils.trailing_slash()),
+                self.wrap_view('async_state_list'),
+                name="api_async_state_list"),
+            url(
+                r"^(?P<resource_name>%s)/state/(?P<task_id>%s)%s$" % (
+                    self._meta.resource_name, TASK_ID_PATTERN,
+                    utils.trailing_slash()),
                 self.wrap_view('async_state'), name="api_async_state"),
             url(
-                r"^(?P<resource_name>%s)/result/(?P<task_id>[\w\-]{36})%s$" % (
-                    self._meta.resource_name, utils.trailing_slash()),
-                self.wrap_view('async_result'), name="api_async_result")
+                r"^(?P<resource_name>%s)/result/(?P<task_id>%s)%s$" % (
+                    self._meta.resource_name, TASK_ID_PATTERN,
+                    utils.trailing_slash()),
+                self.wrap_view('async_result'), name="api_async_result"),
+            url(
+                r"^(?P<resource_name>%s)/events/(?P<task_id>%s)%s$" % (
+                    self._meta.resource_name, TASK_ID_PATTERN,
+                    utils.trailing_slash()),
+                self.wrap_view('async_events'), name="api_async_events"),
+            url(
+                r"^(?P<resource_name>%s)/group/(?P<group_id>%s)%s$" % (
+                    self._meta.resource_name, TASK_ID_PATTERN,
+                    utils.trailing_slash()),
+                self.wrap_view('async_group_state'),
+                name="api_async_group_state"),
+            url(
+                r"^(?P<resource_name>%s)/group/(?P<group_id>%s)/result%s$" % (
+                    self._meta.resource_name, TASK_ID_PATTERN,
+                    utils.trailing_slash()),
+                self.wrap_view('async_group_result'),
+                name="api_async_group_result"),
         ]
 
     def detail_uri_kwargs(self, bundle_or_obj):
@@ -176,29 +1173,167 @@ class AsyncResourceMixin(object):
             Handle ``{method}`` request.
 
             Implement ``async_{method} to add custom request, returning
-            celery.result.AsyncResult. If it returns None, HttpBadRequest
-            is returned from this method. If you don't implement the
-            custom method, it will return HttpNotImplemented.
+            celery.result.AsyncResult (or celery.result.GroupResult, which
+            requires a result backend that can save groups), or a signature
+            which is sent here. If it returns None, HttpBadRequest is
+            returned from this method. If you don't implement the custom
+            method, it will return HttpNotImplemented.
+
+            If ``get_callback_url`` returns a URL, task state is POSTed to
+            it when the task has finished (see tpasync.webhooks). Tasks
+            sent here get the callback as link, others are watched by the
+            ``watch_callback`` task. ``Meta.callback_include_result`` adds
+            the result of successful tasks to the callback.
+
+            With the ``TPASYNC_TASK_STATS`` setting, the response has a
+            ``Retry-After`` header with the expected time until the task is
+            done.
+
+            Before calling the custom method, ``Meta.admission`` (see
+            tpasync.admission) may reject the request, e.g. when the queue
+            is too long.
+
+            With ``Meta.coalesce_requests`` set, a request identical to one
+            whose task hasn't finished yet (see ``request_fingerprint``)
+            gets the state URL of that task instead of running a new one.
+            Fingerprints are kept in ``Meta.coalesce_store`` (a LocalStore
+            by default, use tpasync.store.CacheStore to share them between
+            processes) for ``Meta.coalesce_ttl`` seconds (default 300).
+
+            With ``Meta.result_cache`` set to a store, results of successful
+            tasks are cached by fingerprint for ``Meta.result_cache_ttl``
+            seconds, and identical requests are answered right away, without
+            running a task. Only methods in ``Meta.result_cache_methods``
+            (``get_detail`` and ``get_list`` by default) are cached. Running
+            cacheable tasks are tracked in ``Meta.result_cache_index``,
+            which has to be shared between processes if the cache is.
+
+            With ``Meta.executor`` (see tpasync.executors), signatures are
+            run by a local pool instead of being sent to the broker.
+
+            Tasks are recorded under the tag returned by ``get_task_tag``
+            in ``Meta.tag_store`` (a LocalStore by default, use
+            tpasync.store.CacheStore to share tags between processes), for
+            bulk revocation.
+
+            With ``Meta.result_ttl``, the task is registered in the expiry
+            registry (see tpasync.expiry), to have its result forgotten
+            after that many seconds.
+
+            Hook and publish times are reported to ``Meta.metrics`` (see
+            tpasync.metrics).
             """
+            kwargs = self.remove_api_resource_names(kwargs)
+            # Raises before anything is published
+            ttl = self._result_ttl()
+            coalesce = getattr(self._meta, 'coalesce_requests', False)
+            cache = getattr(self._meta, 'result_cache', None)
+            if method not in getattr(
+                    self._meta, 'result_cache_methods',
+                    ('get_detail', 'get_list')):
+                cache = None
+            if coalesce or cache is not None:
+                fingerprint = self.request_fingerprint(
+                    request, method, **kwargs)
+            if cache is not None:
+                marker = object()
+                cached = cache.get(fingerprint, marker)
+                if cached is not marker:
+                    try:
+                        result = self._process_result(cached)
+                    except Exception, error:
+                        result = {'error': unicode(error)}
+                    try:
+                        return self._result_response(request, result)
+                    except chunks.ChunksExpired:
+                        cache.delete(fingerprint)
+            if coalesce:
+                task_id = self._get_coalesced_task(fingerprint)
+                if task_id is not None:
+                    return self._accepted(task_id)
+            callback_url = self.get_callback_url(request)
+            if callback_url is not None and \
+                    not re.match(r'^https?://', callback_url):
+                return http.HttpBadRequest()
+            admission = getattr(self._meta, 'admission', None)
+            if admission is not None:
+                retry_after = admission.retry_after(request)
+                if retry_after is not None:
+                    return admission.reject(retry_after)
+            metrics = self._metrics()
             try:
-                result = getattr(self, 'async_' + method)(
-                    request, **self.remove_api_resource_names(kwargs))
+                with metrics.timer(
+                        'tpasync_hook_seconds', method=method,
+                        resource=self._meta.resource_name):
+                    result = getattr(self, 'async_' + method)(
+                        request, **kwargs)
                 if result is None:
                     return http.HttpBadRequest()
             except NotImplementedError:
                 return http.HttpNotImplemented()
 
+            executor = getattr(self._meta, 'executor', None)
+            if executor is not None and isinstance(
+                    result, (AsyncResult, GroupResult)) and \
+                    not isinstance(result, LocalResult):
+                # Their state and result views would only look at the
+                # executor
+                raise ImproperlyConfigured(
+                    'async_%s of %s has to return a signature, it has '
+                    'Meta.executor' % (method, self._meta.resource_name))
+            if isinstance(result, Signature):
+                # Only plain task signatures can be linked, not canvases
+                if callback_url is not None and type(result) is Signature:
+                    self._link_callback(request, result, callback_url)
+                    callback_url = None
+                with metrics.timer(
+                        'tpasync_publish_seconds',
+                        resource=self._meta.resource_name):
+                    if executor is not None:
+                        result = executor.submit(result)
+                    else:
+                        result = result.apply_async()
             if isinstance(result, AsyncResult):
+                if callback_url is not None:
+                    self._watch_callback(request, result, callback_url)
                 if isinstance(result, EagerResult):
                     EAGER_RESULTS[result.id] = result
-                response = http.HttpAccepted()
-                response['Location'] = self._build_reverse_url(
-                    'api_async_state',
-                    kwargs={
-                        'api_name': self._meta.api_name,
-                        'resource_name': self._meta.resource_name,
-                        'task_id': result.id})
+                self._tag_tasks(request, [result.id])
+                if ttl:
+                    EXPIRY_REGISTRY.add(result.id, time.time() + ttl)
+                if coalesce:
+                    getattr(
+                        self._meta, 'coalesce_store', COALESCED_REQUESTS).set(
+                        fingerprint, result.id,
+                        ttl=getattr(self._meta, 'coalesce_ttl', 300))
+                if cache is not None:
+                    getattr(
+                        self._meta, 'result_cache_index', CACHED_REQUESTS).set(
+                        result.id, fingerprint)
+                    self._cache_result(result)
+                response = self._accepted(result.id)
+                if getattr(settings, 'TPASYNC_TASK_STATS', False):
+                    TASK_STATS.submitted(result.id, result.task_name)
+                    # Don't ask the backend, the task was just sent
+                    if isinstance(result, EagerResult):
+                        state = result.state
+                    else:
+                        state = states.PENDING
+                    self._retry_after(
+                        response, self._estimate(result.id, state))
                 return response
+            elif isinstance(result, GroupResult):
+                self._tag_tasks(
+                    request, [child.id for child in result.results])
+                if all(isinstance(child, EagerResult)
+                       for child in result.results):
+                    EAGER_RESULTS[result.id] = result
+                    for child in result.results:
+                        EAGER_RESULTS[child.id] = child
+                else:
+                    result.save()
+                return self._accepted(
+                    result.id, 'api_async_group_state', 'group_id')
             else:
                 return result
         inner.__doc__ = inner.__doc__.format(method=method)
@@ -0,0 +1,140 @@
+"""
+Queue wait and run time statistics per task name.
+
+Enabled by the ``TPASYNC_TASK_STATS`` setting. Submission times are
+recorded by the resources, start and finish times by celery signal handlers
+on the workers. To share them between web and worker processes, set
+``TPASYNC_TASK_STATS_CACHE`` to the alias of a Django cache they all use,
+otherwise statistics are kept in process.
+"""
+import time
+
+from celery import signals, states
+from django.conf import settings
+
+from .store import CacheStore, LocalStore
+
+BUCKETS = (
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600,
+    float('inf'))
+
+
+class TaskStats(object):
+    """
+    Histograms of queue wait and run time per task name.
+
+    Timestamps of single tasks are kept in the ``times`` store for ``ttl``
+    seconds, histograms in the ``histograms`` store. Updates of histograms
+    are not atomic, under heavy concurrency a few samples may get lost.
+    """
+
+    def __init__(self, times, histograms, ttl=86400, timer=time.time):
+        self.times = times
+        self.histograms = histograms
+        self.ttl = ttl
+        self.timer = timer
+
+    def submitted(self, task_id, task_name=None):
+        self._update(task_id, name=task_name, submitted=self.timer())
+
+    def started(self, task_id, task_name=None):
+        times = self._update(task_id, name=task_name, started=self.timer())
+        if times.get('name') and 'submitted' in times:
+            self.observe(
+                times['name'], 'queue_wait',
+                times['started'] - times['submitted'])
+
+    def finished(self, task_id, task_name=None):
+        times = self.times.get(task_id) or {}
+        name = times.get('name') or task_name
+        if name and 'started' in times:
+            self.observe(name, 'run_time', self.timer() - times['started'])
+        self.times.delete(task_id)
+
+    def observe(self, task_name, kind, seconds):
+        key = '%s:%s' % (task_name, kind)
+        hist = self.histograms.get(key) or {
+            'count': 0, 'sum': 0.0, 'buckets': [0] * len(BUCKETS)}
+        hist['count'] += 1
+        hist['sum'] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist['buckets'][i] += 1
+                break
+        self.histograms.set(key, hist)
+
+    def histogram(self, task_name, kind):
+        return self.histograms.get('%s:%s' % (task_name, kind))
+
+    def median(self, task_name, kind):
+        """
+        Median of a histogram, interpolated within its bucket, or None.
+        """
+        hist = self.histogram(task_name, kind)
+        if not hist or not hist['count']:
+            return None
+        half, seen, lower = hist['count'] / 2.0, 0, 0.0
+        for bound, count in zip(BUCKETS, hist['buckets']):
+            if count and seen + count >= half:
+                if bound == float('inf'):
+                    return max(lower, hist['sum'] / hist['count'])
+                return lower + (bound - lower) * (half - seen) / count
+            seen += count
+            lower = bound
+
+    def completion(self, task_id, state):
+        """
+        Estimated time (a timestamp) when task ``task_id`` is done, or None.
+
+        It only changes when the task starts or the medians change, not
+        with every call.
+        """
+        times = self.times.get(task_id)
+        if not times or not times.get('name'):
+            return None
+        wait = self.median(times['name'], 'queue_wait') or 0
+        run = self.median(times['name'], 'run_time')
+        if run is None:
+            return None
+        if 'started' in times:
+            return times['started'] + run
+        elif state == states.PENDING and 'submitted' in times:
+            return times['submitted'] + wait + run
+
+    def remaining(self, task_id, state):
+        """
+        Estimated seconds until task ``task_id`` is done, or None.
+        """
+        completion = self.completion(task_id, state)
+        if completion is not None:
+            return max(completion - self.timer(), 0)
+
+    def _update(self, task_id, **values):
+        times = self.times.get(task_id) or {}
+        times.update((k, v) for k, v in values.items() if v is not None)
+        self.times.set(task_id, times, ttl=self.ttl)
+        return times
+
+
+def _get_stats():
+    alias = getattr(settings, 'TPASYNC_TASK_STATS_CACHE', None)
+    if alias:
+        return TaskStats(
+            CacheStore(alias, prefix='tpasync-times'),
+            CacheStore(alias, prefix='tpasync-histograms', ttl=30 * 86400))
+    return TaskStats(LocalStore(max_size=10000), LocalStore(max_size=1000))
+
+
+TASK_STATS = _get_stats()
+
+
+@signals.task_prerun.connect
+def _on_task_prerun(task_id=None, task=None, **kwargs):
+    if getattr(settings, 'TPASYNC_TASK_STATS', False):
+        TASK_STATS.started(task_id, task.name)
+
+
+@signals.task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, **kwargs):
+    if getattr(settings, 'TPASYNC_TASK_STATS', False):
+        TASK_STATS.finished(task_id, task.name)
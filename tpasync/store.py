@@ -0,0 +1,256 @@
+"""
+Small in-process stores used by tastypie-async.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalStore(object):
+    """
+    Thread-safe in-process store with LRU and TTL eviction.
+
+    Holds at most ``max_size`` entries, the least recently used entries are
+    evicted when a new one is added. If ``weigh`` is given, the sum of
+    ``weigh(value)`` of all entries is kept below ``max_weight`` as well.
+    Entries older than ``ttl`` seconds (``None`` means forever) are dropped
+    when they are read. ``stats()`` returns hit, miss, eviction and
+    expiration counters.
+
+    Item access (``store[key]``, ``key in store``) works like on a dict.
+    """
+
+    def __init__(self, max_size=1000, ttl=None, timer=time.time,
+                 weigh=None, max_weight=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.weigh = weigh
+        self.max_weight = max_weight
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.timer():
+                self._forget(value)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            # Re-insert to mark as most recently used.
+            self._data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = self._expires(ttl)
+        with self._lock:
+            self._pop(key)
+            self._insert(key, value, expires)
+
+    def append(self, key, values, ttl=None):
+        """
+        Add ``values`` to the list under ``key`` in place, atomically.
+
+        Starts a new list (expiring after ``ttl``) if there is none.
+        """
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                value = None
+            if value is None or (
+                    expires is not None and expires <= self.timer()):
+                self._pop(key)
+                self._insert(key, list(values), self._expires(ttl))
+                return
+            self._pop(key)
+            value.extend(values)
+            self._insert(key, value, expires)
+
+    def get_list(self, key):
+        """
+        Return a copy of the list ``append`` built under ``key``.
+        """
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return []
+            if expires is not None and expires <= self.timer():
+                return []
+            return list(value)
+
+    def _expires(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return self.timer() + ttl if ttl is not None else None
+
+    def _insert(self, key, value, expires):
+        self._data[key] = (value, expires)
+        if self.weigh is not None:
+            self.weight += self.weigh(value)
+        while self._data and (
+                len(self._data) > self.max_size or (
+                    self.max_weight is not None and
+                    self.weight > self.max_weight)):
+            self._forget(self._data.popitem(last=False)[1][0])
+            self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def purge(self):
+        """
+        Drop all expired entries, return how many there were.
+        """
+        now = self.timer()
+        with self._lock:
+            expired = [
+                key for key, (_, expires) in self._data.items()
+                if expires is not None and expires <= now]
+            for key in expired:
+                self._pop(key)
+            self.expirations += len(expired)
+            return len(expired)
+
+    def _pop(self, key):
+        try:
+            value, _ = self._data.pop(key)
+        except KeyError:
+            pass
+        else:
+            self._forget(value)
+
+    def _forget(self, value):
+        if self.weigh is not None:
+            self.weight -= self.weigh(value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data), 'max_size': self.max_size,
+                'weight': self.weight, 'max_weight': self.max_weight,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+    def __getitem__(self, key):
+        marker = object()
+        value = self.get(key, marker)
+        if value is marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+    def __contains__(self, key):
+        marker = object()
+        return self.get(key, marker) is not marker
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheStore(object):
+    """
+    Store backed by a Django cache, shared between processes.
+
+    Has the same interface as ``LocalStore``. Keys are prefixed with
+    ``prefix``, ``ttl`` is the default timeout in seconds (``None`` uses the
+    timeout of the cache). Eviction is up to the cache, ``stats()`` only
+    counts hits and misses seen by this process.
+    """
+
+    def __init__(self, alias='default', ttl=None, prefix='tpasync'):
+        self.alias = alias
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = self.misses = 0
+
+    @property
+    def cache(self):
+        try:
+            from django.core.cache import caches
+        except ImportError:  # Django < 1.7
+            from django.core.cache import get_cache
+            return get_cache(self.alias)
+        return caches[self.alias]
+
+    def make_key(self, key):
+        return '%s:%s' % (self.prefix, key)
+
+    def get(self, key, default=None):
+        marker = object()
+        value = self.cache.get(self.make_key(key), marker)
+        if value is marker:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is None:
+            self.cache.set(self.make_key(key), value)
+        else:
+            self.cache.set(self.make_key(key), value, ttl)
+
+    def append(self, key, values, ttl=None):
+        """
+        Add ``values`` to the list under ``key``.
+
+        Each value is a cache entry of its own, numbered by an atomic
+        counter, so concurrent appends don't overwrite each other.
+        """
+        if not values:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        timeout = {} if ttl is None else {'timeout': ttl}
+        counter = self.make_key(key)
+        self.cache.add(counter, 0, **timeout)
+        try:
+            last = self.cache.incr(counter, len(values))
+        except ValueError:  # The counter expired meanwhile
+            self.cache.set(counter, len(values), **timeout)
+            last = len(values)
+        first = last - len(values)
+        self.cache.set_many(dict(
+            ('%s:%d' % (counter, first + i), value)
+            for i, value in enumerate(values)), **timeout)
+
+    def get_list(self, key):
+        """
+        Return the values ``append`` added under ``key``.
+        """
+        counter = self.make_key(key)
+        count = self.cache.get(counter) or 0
+        keys = ['%s:%d' % (counter, i) for i in range(count)]
+        found = self.cache.get_many(keys)
+        return [found[item] for item in keys if item in found]
+
+    def delete(self, key):
+        self.cache.delete(self.make_key(key))
+
+    def purge(self):
+        # The cache drops expired entries itself
+        return 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -1,6 +1,75 @@
+import socket
 import time
+import urllib2
+from functools import wraps
 
-from celery import shared_task
+from celery import current_task, shared_task, states, uuid
+from django.conf import settings
+
+from . import chunks, expiry, rendering, webhooks
+# Connect signal handlers that record task run times and final states, and
+# register compressed result serializers
+from . import backends, encoding, stats  # NOQA
+
+
+def rendered(page_size=None):
+    """
+    Render the result of a task function to JSON on the worker.
+
+    Put it below the task decorator. List results are rendered in pages of
+    ``page_size`` objects, or as one page. See tpasync.rendering.
+    """
+    def decorator(fun):
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            return rendering.render(fun(*args, **kwargs), page_size)
+        return wrapper
+    return decorator
+
+
+def chunked(chunk_size=1000, compress=False):
+    """
+    Store the list result of a task function in chunks.
+
+    Put it below the task decorator. The task result is a reference to the
+    chunks, which are written to ``TPASYNC_CHUNK_STORE``, compressed with
+    ``compress``. See tpasync.chunks.
+    """
+    def decorator(fun):
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            return chunks.write(
+                fun(*args, **kwargs), chunk_size, compress=compress)
+        return wrapper
+    return decorator
+
+
+def partial(chunk_size=1000):
+    """
+    Make the list result of a task function readable while it runs.
+
+    Put it below the task decorator. The function is a generator yielding
+    batches (lists) of objects, which are appended to
+    ``TPASYNC_CHUNK_STORE`` in chunks of ``chunk_size`` objects. Result
+    views of resources with ``Meta.partial_results`` serve the chunks
+    written so far. The task result is a reference to all chunks, like
+    with ``chunked``. If the function raises, the chunks written so far are
+    deleted. See tpasync.chunks.
+    """
+    def decorator(fun):
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            task_id = current_task.request.id if current_task else None
+            writer = chunks.PartialWriter(task_id or uuid(), chunk_size)
+            try:
+                for batch in fun(*args, **kwargs):
+                    writer.extend(batch)
+                return writer.close()
+            except Exception:
+                writer.delete()
+                raise
+        return wrapper
+    return decorator
 
 
 @shared_task
@@ -19,3 +88,87 @@ def list_task():
 def failing_task():
     raise Exception('I failed miserably')
 
+
+@shared_task
+def sweep_results(limit=1000):
+    """
+    Forget results past their ``Meta.result_ttl``, see tpasync.expiry.
+
+    Eager results, finished states and cached responses of this process
+    (or shared by it) are dropped as well. Returns the sweep counters.
+    """
+    # Imported here, tpasync.resources imports this module
+    from .resources import (
+        EAGER_RESULTS, FINISHED_STATES, RESPONSE_CACHE_INDEX)
+    return expiry.sweep(
+        stores=(EAGER_RESULTS, FINISHED_STATES, RESPONSE_CACHE_INDEX),
+        limit=limit)
+
+
+@shared_task
+def merge_results(results):
+    """
+    Merge chunk results of a fan-out job into a single list.
+
+    List results are concatenated, other results are appended.
+    """
+    merged = []
+    for result in results:
+        if isinstance(result, list):
+            merged.extend(result)
+        else:
+            merged.append(result)
+    return merged
+
+
+@shared_task(bind=True, ignore_result=True)
+def deliver_callback(self, value, callback_url, data, include_result=False):
+    """
+    POST task ``data`` to ``callback_url``.
+
+    Used as ``link`` (``value`` is the task result) and ``link_error``
+    (``value`` is the task id) of tasks. Rendered and chunked results are
+    expanded to the objects they hold. Deliveries that fail to connect,
+    time out or get a 5xx (or 429) response are retried with exponential
+    backoff, up to ``TPASYNC_WEBHOOK_RETRIES`` times (5 by default).
+    """
+    if include_result and data['state'] == states.SUCCESS:
+        if rendering.is_rendered(value):
+            value = rendering.decode(value)
+        elif chunks.is_chunked(value):
+            value = list(chunks.ChunkedList(value))
+        data = dict(data, result=value)
+    try:
+        webhooks.post_callback(callback_url, data)
+    except (urllib2.URLError, socket.error), error:
+        # Callbacks the receiver rejected won't be accepted later either
+        if isinstance(error, urllib2.HTTPError) and \
+                error.code < 500 and error.code != 429:
+            raise
+        raise self.retry(
+            exc=error, countdown=2 ** self.request.retries,
+            max_retries=getattr(settings, 'TPASYNC_WEBHOOK_RETRIES', 5))
+
+
+@shared_task(bind=True, ignore_result=True)
+def watch_callback(self, task_id, callback_url, data, include_result=False):
+    """
+    Wait for task ``task_id`` to finish, then deliver its callback.
+
+    For tasks that were sent without a link. The task is checked every
+    ``TPASYNC_WEBHOOK_POLL_INTERVAL`` seconds (5 by default), for no longer
+    than ``TPASYNC_WEBHOOK_POLL_TIMEOUT`` seconds (a day by default). The
+    state is read from the result backend of the app the task was sent
+    with.
+    """
+    task = self.app.AsyncResult(task_id)
+    if not task.ready():
+        interval = getattr(settings, 'TPASYNC_WEBHOOK_POLL_INTERVAL', 5)
+        raise self.retry(
+            countdown=interval,
+            max_retries=getattr(
+                settings, 'TPASYNC_WEBHOOK_POLL_TIMEOUT', 86400) // interval)
+    value = task.result if task.successful() else task_id
+    deliver_callback.apply_async(
+        (value, callback_url, dict(data, state=task.state), include_result),
+        **webhooks.task_options())
@@ -1,10 +1,53 @@
+import gzip
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
 import time
+import unittest
+import uuid
+from StringIO import StringIO
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from celery import Celery, group, signals, states
+from celery.result import EagerResult
 from django import http
-from tpasync.resources import BaseAsyncResource
+from django.core.exceptions import ImproperlyConfigured
+from kombu.serialization import dumps, loads
+from tpasync.resources import (
+    BaseAsyncResource, EAGER_RESULTS, FINISHED_STATES)
 from tastypie import fields
 from tastypie.test import ResourceTestCaseMixin
-from . import tasks
+from . import (
+    chunks, encoding, expiry, rendering, resources, stats, tasks, testtasks)
+from .admission import QueueDepthAdmission, TokenBucketAdmission
+from .backends import (
+    DatabaseBackend, ResultBackend, get_results, get_states, watch)
+from .executors import ProcessExecutor, ThreadExecutor
+from .metrics import NullMetrics, PrometheusMetrics, metrics_view
+from .stats import TaskStats
+from .store import CacheStore, LocalStore
+from .watcher import StateWatcher
+from .webhooks import sign
+from django.test.client import RequestFactory
 from django.test.testcases import TestCase
+from django.test.utils import override_settings
+
+
+class ProgressResult(EagerResult):
+    """
+    Result that moves on to the next of ``states`` when waited for.
+    """
+    states = []
+
+    def get(self, timeout=None, propagate=True, **kwargs):
+        if self.states:
+            state = self.states.pop(0)
+            if isinstance(state, tuple):
+                state, self._result = state
+            self._state = state
+        return self._result
 
 
 class EmptyTestResource(BaseAsyncResource):
@@ -32,6 +75,281 @@ class TestResource(BaseAsyncResource):
         return tasks.failing_task.apply_async()
 
 
+class EagerTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'eager'
+        max_state_wait = 5
+
+    def async_get_detail(self, request, **kwargs):
+        return testtasks.quick_task.apply()
+
+    def async_get_list(self, request, **kwargs):
+        return tasks.list_task.apply()
+
+    def async_post_detail(self, request, **kwargs):
+        return tasks.failing_task.apply()
+
+    def async_post_list(self, request, **kwargs):
+        return group(
+            tasks.list_task.s(), testtasks.quick_task.s(),
+            tasks.failing_task.s()).apply()
+
+
+class CoalescingTestResource(BaseAsyncResource):
+    class Meta:
+        resource_name = 'coalesce'
+        coalesce_requests = True
+
+    def async_get_detail(self, request, **kwargs):
+        # A task that never finishes
+        return EagerResult(str(uuid.uuid4()), None, states.STARTED)
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.quick_task.apply()
+
+
+class CachingTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'cached'
+        result_cache = LocalStore()
+        response_cache = LocalStore(
+            weigh=lambda value: len(value[0]), max_weight=10000)
+
+    def async_get_detail(self, request, **kwargs):
+        return testtasks.quick_task.apply()
+
+    def async_get_list(self, request, **kwargs):
+        return tasks.list_task.apply()
+
+
+class StreamingTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'stream'
+        stream_results = True
+        max_limit = 0
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.range_task.apply(args=(250,))
+
+
+class WebhookTestResource(BaseAsyncResource):
+    class Meta:
+        resource_name = 'webhook'
+        allow_callback_url = True
+        callback_include_result = True
+
+    def async_get_detail(self, request, **kwargs):
+        return testtasks.quick_task.s()
+
+    def async_post_detail(self, request, **kwargs):
+        return tasks.failing_task.s()
+
+    def async_get_list(self, request, **kwargs):
+        return tasks.list_task.apply()
+
+
+class CallbackReceiver(HTTPServer):
+    """
+    Local HTTP server that collects POSTed callbacks.
+    """
+    def __init__(self):
+        self.received = []
+        # Status codes of the next responses, 204 when empty
+        self.statuses = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(handler):
+                body = handler.rfile.read(
+                    int(handler.headers['Content-Length']))
+                self.received.append((
+                    handler.headers.get('X-Tpasync-Signature'), body))
+                handler.send_response(
+                    self.statuses.pop(0) if self.statuses else 204)
+                handler.end_headers()
+
+            def log_message(handler, *args):
+                pass
+
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/' % self.server_port
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class FixedDepthAdmission(QueueDepthAdmission):
+    depths = []
+
+    def get_depth(self):
+        return self.depths.pop(0)
+
+
+class AdmissionTestResource(BaseAsyncResource):
+    class Meta:
+        resource_name = 'admission'
+        admission = FixedDepthAdmission(max_depth=10, drain_rate=2)
+
+    def async_get_detail(self, request, **kwargs):
+        return testtasks.quick_task.apply()
+
+
+class SlowTestResource(BaseAsyncResource):
+    class Meta:
+        resource_name = 'slow'
+
+    def async_get_detail(self, request, **kwargs):
+        result = EagerResult(str(uuid.uuid4()), None, states.PENDING)
+        result.task_name = 'tpasync.tests.slow'
+        return result
+
+
+class MetricsTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'metered'
+        metrics = PrometheusMetrics()
+
+    def async_get_list(self, request, **kwargs):
+        return tasks.list_task.s()
+
+
+class ExecutorTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'executor'
+        max_state_wait = 5
+        executor = ThreadExecutor(1)
+
+    def async_get_detail(self, request, **kwargs):
+        return testtasks.quick_task.s()
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.sleeping_task.s(0.5)
+
+    def async_post_detail(self, request, **kwargs):
+        return tasks.failing_task.s()
+
+
+class PartialTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'partial'
+        max_state_wait = 5
+        executor = ThreadExecutor(1)
+        partial_results = True
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.partial_range_task.s(10, 1)
+
+
+class RenderedTestResource(BaseAsyncResource):
+    class Meta:
+        resource_name = 'rendered'
+        limit = 10
+
+    def async_get_detail(self, request, **kwargs):
+        return testtasks.rendered_task.apply()
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.rendered_range_task.apply(args=(25,))
+
+
+class ChunkedTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'chunked'
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.chunked_range_task.apply(args=(25,))
+
+
+class ExpiringTestResource(BaseAsyncResource):
+    class Meta:
+        resource_name = 'expiring'
+        result_ttl = 60
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.chunked_range_task.apply(args=(25,))
+
+
+class CompactTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'compact'
+        compress_results = True
+        if encoding.msgpack is not None:
+            serializer = encoding.CompactSerializer()
+
+    def async_get_list(self, request, **kwargs):
+        return testtasks.compressed_range_task.apply(args=(100,))
+
+
+class RecordingChunkStore(chunks.MemoryChunkStore):
+    def __init__(self):
+        super(RecordingChunkStore, self).__init__()
+        self.reads = []
+
+    def read(self, key, first, last):
+        self.reads.append((first, last))
+        return super(RecordingChunkStore, self).read(key, first, last)
+
+
+MEMORY_APP = Celery(
+    set_as_current=False, broker='memory://', backend='cache+memory://')
+
+
+class FanOutTestResource(BaseAsyncResource):
+    id = fields.IntegerField()
+    result = fields.CharField()
+
+    class Meta:
+        resource_name = 'fanout'
+        fan_out_chunk_size = 3
+        fan_out_store = LocalStore()
+        result_backend = ResultBackend(MEMORY_APP)
+
+    def async_post_list(self, request, **kwargs):
+        return self.fan_out(testtasks.items_task, range(10))
+
+
+class CountingResultBackend(ResultBackend):
+    def __init__(self, app=None):
+        super(CountingResultBackend, self).__init__(app)
+        self.batches = []
+
+    def get_states(self, task_ids):
+        self.batches.append(sorted(task_ids))
+        return super(CountingResultBackend, self).get_states(task_ids)
+
+
+class WatchedTestResource(BaseAsyncResource):
+    class Meta:
+        resource_name = 'watched'
+        max_state_wait = 5
+        result_backend = ResultBackend(MEMORY_APP)
+        state_watcher = StateWatcher(
+            interval=0.05, result_backend=result_backend)
+
+
 class AsyncResourceTest(ResourceTestCaseMixin, TestCase):
     def setUp(self):
         super(AsyncResourceTest, self).setUp()
@@ -158,3 +476,1225 @@ class AsyncResourceTest(ResourceTestCaseMixin, TestCase):
                 u'previous': None, u'total_count': 2, u'offset': 0,
                 u'limit': 1, u'next': u'/api/v1/test/?limit=1&offset=1'},
              u'objects': [{u'id': 1, u'result': u'ok'}]})
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True)
+class EagerAsyncResourceTest(ResourceTestCaseMixin, TestCase):
+    def test_long_poll(self):
+        result = self.api_client.get('/api/v1/eager/1/')
+        self.assertHttpAccepted(result)
+        state_url = result['Location']
+
+        # Finished tasks are returned right away, wait is ignored
+        response = self.api_client.get(state_url + '?wait=60')
+        self.assertHttpOK(response)
+        data = self.deserialize(response)
+        self.assertEqual(data['state'], 'SUCCESS')
+        self.assertIn('result_uri', data)
+
+        # Garbage wait values are ignored as well
+        response = self.api_client.get(state_url + '?wait=soon')
+        self.assertHttpOK(response)
+
+    def test_state_list(self):
+        task_ids = []
+        for url in ('/api/v1/eager/1/', '/api/v1/eager/'):
+            result = self.api_client.get(url)
+            self.assertHttpAccepted(result)
+            task_ids.append(result['Location'].split('/')[-2])
+        task_ids.append(str(uuid.uuid4()))
+
+        response = self.api_client.get(
+            '/api/v1/eager/state/?ids=' + ','.join(task_ids))
+        self.assertHttpOK(response)
+        objects = self.deserialize(response)['objects']
+        self.assertEqual([obj['id'] for obj in objects], task_ids)
+        self.assertEqual(
+            [obj['state'] for obj in objects],
+            ['SUCCESS', 'SUCCESS', 'PENDING'])
+        self.assertIn('result_uri', objects[0])
+        self.assertNotIn('result_uri', objects[2])
+
+        response = self.api_client.post(
+            '/api/v1/eager/state/', data={'ids': task_ids[:1]})
+        self.assertHttpOK(response)
+        self.assertEqual(len(self.deserialize(response)['objects']), 1)
+
+        response = self.api_client.get('/api/v1/eager/state/')
+        self.assertHttpBadRequest(response)
+        response = self.api_client.get('/api/v1/eager/state/?ids=unknown')
+        self.assertHttpBadRequest(response)
+        response = self.api_client.post(
+            '/api/v1/eager/state/', data={'ids': [1]})
+        self.assertHttpBadRequest(response)
+        # No limit with max_limit = 0
+        response = self.api_client.get(
+            '/api/v1/stream/state/?ids=' + ','.join(task_ids))
+        self.assertHttpOK(response)
+        response = self.api_client.put('/api/v1/eager/state/')
+        self.assertHttpForbidden(response)
+
+    def test_group(self):
+        result = self.api_client.post('/api/v1/eager/')
+        self.assertHttpAccepted(result)
+        state_url = result['Location']
+        self.assertIn('/api/v1/eager/group/', state_url)
+
+        response = self.api_client.get(state_url)
+        self.assertHttpOK(response)
+        data = self.deserialize(response)
+        self.assertEqual(data['state'], 'FAILURE')
+        self.assertEqual(
+            (data['total'], data['completed'], data['failed'],
+             data['pending']),
+            (3, 2, 1, 0))
+
+        response = self.api_client.get(data['result_uri'] + '?limit=3')
+        self.assertHttpOK(response)
+        data = self.deserialize(response)
+        self.assertEqual(data['meta']['total_count'], 4)
+        self.assertEqual(
+            data['objects'],
+            [{u'id': 1, u'result': u'ok'},
+             {u'id': 2, u'result': u'not bad'},
+             {u'id': 1, u'result': u'ok'}])
+
+        response = self.api_client.get(
+            '/api/v1/eager/group/{}/'.format(uuid.uuid4()))
+        self.assertHttpNotFound(response)
+
+    def test_group_expired_chunks(self):
+        result = group(testtasks.chunked_range_task.s(5)).apply()
+        EAGER_RESULTS.set(result.id, result)
+        chunks.ChunkedList(result.results[0].result).delete()
+        response = ChunkedTestResource().async_group_result(
+            RequestFactory().get('/'), result.id)
+        self.assertHttpNotFound(response)
+
+    def test_group_result_cached(self):
+        result = group(testtasks.chunked_range_task.s(5)).apply()
+        EAGER_RESULTS.set(result.id, result)
+        resource = ChunkedTestResource()
+        response = resource.async_group_result(
+            RequestFactory().get('/?limit=2'), result.id)
+        self.assertEqual(
+            [item['id'] for item in self.deserialize(response)['objects']],
+            [0, 1])
+        # following pages don't read the chunks again
+        chunks.ChunkedList(result.results[0].result).delete()
+        response = resource.async_group_result(
+            RequestFactory().get('/?limit=2&offset=2'), result.id)
+        self.assertEqual(
+            [item['id'] for item in self.deserialize(response)['objects']],
+            [2, 3])
+
+    def test_bulk_revoke(self):
+        group_url = self.api_client.post('/api/v1/eager/?tag=batch')[
+            'Location']
+        group_id = group_url.rstrip('/').split('/')[-1]
+        state_url = self.api_client.get('/api/v1/eager/1/?tag=batch')[
+            'Location']
+        task_id = state_url.rstrip('/').split('/')[-1]
+        data = self.deserialize(
+            self.api_client.delete('/api/v1/eager/state/?tag=batch'))
+        self.assertEqual(data['revoked'], [])
+        self.assertEqual(len(data['finished']), 4)
+        self.assertEqual(data['finished'][-1], task_id)
+        data = self.deserialize(self.api_client.delete(
+            '/api/v1/eager/state/?group={}'.format(group_id)))
+        self.assertEqual(len(data['finished']), 3)
+
+        self.assertHttpNotFound(self.api_client.delete(
+            '/api/v1/eager/state/?group={}'.format(uuid.uuid4())))
+        self.assertHttpBadRequest(
+            self.api_client.delete('/api/v1/eager/state/?ids=bad'))
+        self.assertHttpBadRequest(
+            self.api_client.delete('/api/v1/eager/state/'))
+
+    def test_evicted_result(self):
+        response = self.api_client.get(
+            '/api/v1/eager/state/{}/'.format(uuid.uuid4()))
+        self.assertHttpNotFound(response)
+        response = self.api_client.get(
+            '/api/v1/eager/result/{}/'.format(uuid.uuid4()))
+        self.assertHttpNotFound(response)
+
+    def test_coalescing(self):
+        first = self.api_client.get('/api/v1/coalesce/1/')
+        self.assertHttpAccepted(first)
+        second = self.api_client.get('/api/v1/coalesce/1/')
+        self.assertEqual(first['Location'], second['Location'])
+        other = self.api_client.get('/api/v1/coalesce/2/')
+        self.assertNotEqual(first['Location'], other['Location'])
+        other = self.api_client.get('/api/v1/coalesce/1/?foo=bar')
+        self.assertNotEqual(first['Location'], other['Location'])
+
+        # Finished tasks are never reused
+        first = self.api_client.get('/api/v1/coalesce/')
+        second = self.api_client.get('/api/v1/coalesce/')
+        self.assertNotEqual(first['Location'], second['Location'])
+
+    def test_result_cache(self):
+        resource = CachingTestResource()
+        cache = resource._meta.result_cache
+        cache.clear()
+        response = self.api_client.get('/api/v1/cached/1/')
+        self.assertHttpAccepted(response)
+
+        # Same request is answered from cache
+        response = self.api_client.get('/api/v1/cached/1/')
+        self.assertHttpOK(response)
+        self.assertEqual(
+            self.deserialize(response), {u'id': 1, u'result': u'ok'})
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        response = self.api_client.get('/api/v1/cached/2/')
+        self.assertHttpAccepted(response)
+
+        request = RequestFactory().get('/api/v1/cached/1/')
+        resource.invalidate_cached_result(request, 'get_detail', pk='1')
+        response = self.api_client.get('/api/v1/cached/1/')
+        self.assertHttpAccepted(response)
+
+    def test_public_results(self):
+        class PublicResource(BaseAsyncResource):
+            class Meta:
+                result_cache_public = True
+
+        response = PublicResource()._immutable(http.HttpResponse(), 'key')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('private', response['Cache-Control'])
+
+    def test_response_cache(self):
+        resource = CachingTestResource()
+        cache = resource._meta.response_cache
+        cache.clear()
+        result_url = self.api_client.get(
+            '/api/v1/cached/')['Location'].replace('/state/', '/result/')
+        response = self.api_client.get(result_url + '?limit=1')
+        self.assertHttpOK(response)
+        cache_control = response['Cache-Control']
+        self.assertIn('immutable', cache_control)
+        self.assertIn('private', cache_control)
+        self.assertNotIn('public', cache_control)
+        self.assertIn('Accept', response['Vary'])
+        etag = response['ETag']
+        data = self.deserialize(response)
+        self.assertEqual(len(cache), 1)
+
+        cached = self.api_client.get(result_url + '?limit=1')
+        self.assertEqual(cached['ETag'], etag)
+        self.assertEqual(self.deserialize(cached), data)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        other = self.api_client.get(result_url + '?limit=2')
+        self.assertNotEqual(other['ETag'], etag)
+        self.assertEqual(len(self.deserialize(other)['objects']), 2)
+
+        # Forgotten results aren't served from the cache, even by
+        # processes that still know the task as finished
+        task_id = result_url.split('/')[-2]
+        self.assertEqual(
+            self.api_client.delete(result_url).status_code, 204)
+        FINISHED_STATES.set(task_id, states.SUCCESS)
+        self.assertHttpNotFound(self.api_client.get(result_url + '?limit=1'))
+
+        # Failures are not cached
+        result_url = self.api_client.post(
+            '/api/v1/eager/1/')['Location'].replace('/state/', '/result/')
+        response = self.api_client.get(result_url)
+        self.assertHttpOK(response)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_conditional_get(self):
+        task_id = str(uuid.uuid4())
+        EAGER_RESULTS[task_id] = EagerResult(task_id, None, states.STARTED)
+        state_url = '/api/v1/eager/state/{}/'.format(task_id)
+        response = self.api_client.get(state_url)
+        self.assertHttpOK(response)
+        etag = response['ETag']
+        response = self.api_client.get(state_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Changed state, new ETag
+        EAGER_RESULTS[task_id] = EagerResult(
+            task_id, {'result': 'ok', 'id': 1}, states.SUCCESS)
+        response = self.api_client.get(state_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertHttpOK(response)
+        etag = response['ETag']
+        result_url = state_url.replace('/state/', '/result/')
+        result_etag = self.api_client.get(result_url)['ETag']
+
+        # Finished tasks are answered without the result backend
+        del EAGER_RESULTS[task_id]
+        response = self.api_client.get(state_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.api_client.get(state_url)
+        self.assertEqual(self.deserialize(response)['state'], 'SUCCESS')
+        response = self.api_client.get(
+            result_url, HTTP_IF_NONE_MATCH=result_etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], result_etag)
+
+    def test_metrics(self):
+        metrics = MetricsTestResource._meta.metrics
+        state_url = self.api_client.get('/api/v1/metered/')['Location']
+        self.api_client.get(state_url)
+        self.api_client.get(state_url.replace('/state/', '/result/'))
+        text = metrics_view(
+            RequestFactory().get('/metrics'), metrics=metrics).content
+        for line in (
+                '# TYPE tpasync_hook_seconds histogram',
+                'tpasync_hook_seconds_count'
+                '{method="get_list",resource="metered"} 1',
+                'tpasync_publish_seconds_count{resource="metered"} 1',
+                'tpasync_backend_seconds_count'
+                '{resource="metered",view="result"} 1',
+                'tpasync_states_total{resource="metered",state="SUCCESS"} 1.0',
+                'tpasync_paginate_seconds_count{resource="metered"} 1',
+                'tpasync_response_bytes_count{resource="metered"} 1'):
+            self.assertIn(line, text.splitlines())
+
+    def test_rendered(self):
+        result_url = self.api_client.get(
+            '/api/v1/rendered/1/')['Location'].replace('/state/', '/result/')
+        self.assertEqual(
+            self.deserialize(self.api_client.get(result_url)),
+            {u'id': 1, u'result': u'ok'})
+
+        result_url = self.api_client.get(
+            '/api/v1/rendered/')['Location'].replace('/state/', '/result/')
+        expected = [{u'result': u'ok', u'id': i} for i in range(25)]
+        for query, start, stop in (
+                ('', 0, 10), ('?offset=10', 10, 20), ('?offset=20', 20, 25),
+                ('?limit=20&offset=5', 5, 25), ('?limit=3&offset=9', 9, 12),
+                ('?offset=30', 25, 25)):
+            data = self.deserialize(self.api_client.get(result_url + query))
+            self.assertEqual(data['objects'], expected[start:stop], query)
+            self.assertEqual(data['meta']['total_count'], 25)
+        data = self.deserialize(self.api_client.get(result_url))
+        self.assertEqual(data['meta']['offset'], 0)
+        self.assertEqual(data['meta']['limit'], 10)
+        self.assertIn('offset=10', data['meta']['next'])
+
+        # Other formats decode the result
+        self.assertEqual(
+            rendering.decode(testtasks.rendered_range_task(25)), expected)
+
+        # Lists rendered without page size are paginated as well
+        request = RequestFactory().get(
+            '/?limit=1', HTTP_ACCEPT='application/json')
+        resource = RenderedTestResource()
+        for rendered in (rendering.render(expected[:2]),
+                         {rendering.MARKER: 1,
+                          'content': json.dumps(expected[:2])}):
+            data = json.loads(
+                resource._rendered_response(request, rendered).content)
+            self.assertEqual(data['objects'], expected[:1])
+            self.assertEqual(data['meta']['total_count'], 2)
+        self.assertEqual(rendering.decode(rendering.render([])), [])
+
+    def test_chunked(self):
+        state_url = self.api_client.get('/api/v1/chunked/')['Location']
+        result_url = state_url.replace('/state/', '/result/')
+        data = self.deserialize(
+            self.api_client.get(result_url + '?limit=5&offset=12'))
+        self.assertEqual(
+            [obj['id'] for obj in data['objects']], range(12, 17))
+        self.assertEqual(data['meta']['total_count'], 25)
+
+        # Gone chunks are like gone results
+        task_id = state_url.rstrip('/').split('/')[-1]
+        chunks.CHUNK_STORE.delete(
+            EAGER_RESULTS[task_id].result[chunks.MARKER])
+        self.assertHttpNotFound(
+            self.api_client.get(result_url + '?limit=5&offset=12'))
+
+    def test_forget_result(self):
+        state_url = self.api_client.get('/api/v1/expiring/')['Location']
+        result_url = state_url.replace('/state/', '/result/')
+        task_id = state_url.rstrip('/').split('/')[-1]
+        registry = expiry.EXPIRY_REGISTRY
+        self.assertIn(task_id, registry._expires)
+        self.assertHttpOK(self.api_client.get(result_url))
+        key = EAGER_RESULTS[task_id].result[chunks.MARKER]
+
+        self.assertEqual(
+            self.api_client.delete(result_url).status_code, 204)
+        self.assertRaises(KeyError, chunks.CHUNK_STORE.read, key, 0, 0)
+        self.assertNotIn(task_id, registry._expires)
+        self.assertHttpNotFound(self.api_client.get(result_url))
+        self.assertHttpNotFound(self.api_client.get(state_url))
+        self.assertHttpNotFound(self.api_client.delete(result_url))
+
+    def test_compressed(self):
+        state_url = self.api_client.get('/api/v1/compact/')['Location']
+        result_url = state_url.replace('/state/', '/result/') + '?limit=50'
+        response = self.client.get(result_url)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertFalse(response['ETag'].startswith('W/'))
+
+        response = self.client.get(result_url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(
+            gzip.GzipFile(fileobj=StringIO(response.content)).read())
+        self.assertEqual([obj['id'] for obj in data['objects']], range(50))
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.client.get(
+            result_url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    @unittest.skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        state_url = self.api_client.get('/api/v1/compact/')['Location']
+        response = self.client.get(
+            state_url.replace('/state/', '/result/') + '?limit=5',
+            HTTP_ACCEPT='application/x-msgpack')
+        self.assertTrue(
+            response['Content-Type'].startswith('application/x-msgpack'))
+        data = encoding.msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(
+            data['objects'][:2],
+            [{'id': 0, 'result': 'ok'}, {'id': 1, 'result': 'ok'}])
+        self.assertEqual(data['meta']['total_count'], 100)
+
+    def test_fan_out(self):
+        response = self.api_client.post('/api/v1/fanout/')
+        self.assertHttpAccepted(response)
+        data = self.deserialize(self.api_client.get(response['Location']))
+        self.assertEqual(data['state'], 'SUCCESS')
+        self.assertNotIn('progress', data)
+        data = self.deserialize(self.api_client.get(data['result_uri']))
+        self.assertEqual(
+            [obj['id'] for obj in data['objects']], range(10))
+
+    def test_streaming(self):
+        result_url = self.api_client.get(
+            '/api/v1/stream/')['Location'].replace('/state/', '/result/')
+        response = self.api_client.get(result_url + '?limit=0')
+        self.assertHttpOK(response)
+        self.assertTrue(response.streaming)
+        data = json.loads(''.join(response.streaming_content))
+        self.assertEqual(data['meta']['total_count'], 250)
+        self.assertEqual(
+            data['objects'],
+            [{'id': i, 'result': 'ok'} for i in range(250)])
+
+        response = self.api_client.get(result_url + '?limit=1&offset=1')
+        data = json.loads(''.join(response.streaming_content))
+        self.assertEqual(data['objects'], [{'id': 1, 'result': 'ok'}])
+
+    def test_events(self):
+        state_url = self.api_client.get('/api/v1/eager/1/')['Location']
+        response = self.api_client.get(
+            state_url.replace('/state/', '/events/'))
+        self.assertHttpOK(response)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = ''.join(response.streaming_content).split('\n\n')
+        self.assertEqual(events[0], 'retry: 1000')
+        lines = events[1].split('\n')
+        self.assertEqual(lines[:2], ['id: 0', 'event: state'])
+        data = json.loads(lines[2][len('data: '):])
+        self.assertEqual(data['state'], 'SUCCESS')
+        self.assertIn('result_uri', data)
+        self.assertEqual(events[2:], [''])
+
+    @override_settings(TPASYNC_WEBHOOK_SECRET='s3cret')
+    def test_callbacks(self):
+        receiver = CallbackReceiver()
+        self.addCleanup(receiver.shutdown)
+        query = '?callback_url=' + receiver.url
+
+        # Linked callbacks of signatures
+        response = self.api_client.get('/api/v1/webhook/1/' + query)
+        self.assertHttpAccepted(response)
+        task_id = response['Location'].split('/')[-2]
+        response = self.api_client.post('/api/v1/webhook/1/' + query)
+        self.assertHttpAccepted(response)
+        failed_id = response['Location'].split('/')[-2]
+        # Callbacks of results that were already sent
+        response = self.api_client.get('/api/v1/webhook/' + query)
+        self.assertHttpAccepted(response)
+        list_id = response['Location'].split('/')[-2]
+
+        self.assertEqual(len(receiver.received), 3)
+        for signature, body in receiver.received:
+            self.assertEqual(signature, sign(body, 's3cret'))
+        callbacks = [json.loads(body) for _, body in receiver.received]
+        self.assertEqual(
+            [(data['id'], data['state']) for data in callbacks],
+            [(task_id, 'SUCCESS'), (failed_id, 'FAILURE'),
+             (list_id, 'SUCCESS')])
+        self.assertEqual(callbacks[0]['result'], {'result': 'ok', 'id': 1})
+        self.assertNotIn('result', callbacks[1])
+        self.assertEqual(
+            callbacks[0]['result_uri'],
+            'http://testserver/api/v1/webhook/result/%s/' % task_id)
+
+        response = self.api_client.get(
+            '/api/v1/webhook/1/?callback_url=file:///etc/passwd')
+        self.assertHttpBadRequest(response)
+
+    def test_callback_result_backend(self):
+        class OwnBackendResource(BaseAsyncResource):
+            class Meta:
+                resource_name = 'watched'
+                api_name = 'v1'
+                allow_callback_url = True
+                result_backend = ResultBackend(MEMORY_APP)
+
+            def async_get_detail(self, request, **kwargs):
+                return MEMORY_APP.AsyncResult(task_id)
+
+        receiver = CallbackReceiver()
+        self.addCleanup(receiver.shutdown)
+        task_id = str(uuid.uuid4())
+        MEMORY_APP.backend.store_result(task_id, None, states.SUCCESS)
+        # Runs the watch_callback task right away
+        MEMORY_APP.conf.CELERY_ALWAYS_EAGER = True
+        self.addCleanup(
+            setattr, MEMORY_APP.conf, 'CELERY_ALWAYS_EAGER', False)
+        response = OwnBackendResource().get_detail(RequestFactory().get(
+            '/?callback_url=' + receiver.url), pk=1)
+        self.assertHttpAccepted(response)
+        self.assertEqual(
+            [json.loads(body)['state'] for _, body in receiver.received],
+            ['SUCCESS'])
+
+    def test_callback_delivery(self):
+        receiver = CallbackReceiver()
+        self.addCleanup(receiver.shutdown)
+        data = {'id': 'task', 'state': 'SUCCESS'}
+        objects = [{'id': i} for i in range(3)]
+
+        # Server errors are retried, rejected callbacks are not
+        receiver.statuses[:] = [503, 204, 404]
+        tasks.deliver_callback.apply((None, receiver.url, data))
+        self.assertEqual(len(receiver.received), 2)
+        result = tasks.deliver_callback.apply((None, receiver.url, data))
+        self.assertEqual(result.state, states.FAILURE)
+        self.assertEqual(len(receiver.received), 3)
+
+        del receiver.received[:]
+        for value in (rendering.render(objects, page_size=2),
+                      chunks.write(objects, chunk_size=2)):
+            tasks.deliver_callback.apply(
+                (value, receiver.url, data, True))
+        self.assertEqual(
+            [json.loads(body)['result'] for _, body in receiver.received],
+            [objects, objects])
+
+    def test_admission(self):
+        admission = AdmissionTestResource._meta.admission
+        admission.depths[:] = [5, 30]
+        response = self.api_client.get('/api/v1/admission/1/')
+        self.assertHttpAccepted(response)
+        # Depth is cached
+        response = self.api_client.get('/api/v1/admission/1/')
+        self.assertHttpAccepted(response)
+
+        admission._expires = 0
+        response = self.api_client.get('/api/v1/admission/1/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '10')
+        self.assertEqual(admission.depths, [])
+
+    @override_settings(TPASYNC_TASK_STATS=True)
+    def test_estimates(self):
+        # Keep samples out of the process-wide histograms
+        task_stats = TaskStats(LocalStore(), LocalStore())
+        for module in (resources, stats):
+            self.addCleanup(setattr, module, 'TASK_STATS', module.TASK_STATS)
+            module.TASK_STATS = task_stats
+        for i in range(3):
+            task_stats.observe('tpasync.tests.slow', 'queue_wait', 10)
+            task_stats.observe('tpasync.tests.slow', 'run_time', 60)
+        response = self.api_client.get('/api/v1/slow/1/')
+        self.assertHttpAccepted(response)
+        self.assertTrue(50 < int(response['Retry-After']) <= 53)
+
+        state_url = response['Location']
+        response = self.api_client.get(state_url)
+        self.assertTrue(50 < int(response['Retry-After']) <= 53)
+        self.assertIn('estimated_completion', self.deserialize(response))
+        # The estimate doesn't move between polls
+        response = self.api_client.get(
+            state_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(50 < int(response['Retry-After']) <= 53)
+
+        # No estimates for finished tasks
+        response = self.api_client.get(
+            self.api_client.get('/api/v1/eager/1/')['Location'])
+        self.assertFalse(response.has_header('Retry-After'))
+        self.assertNotIn('estimated_completion', self.deserialize(response))
+
+
+class TaskStatsTest(TestCase):
+    def test_stats(self):
+        now = [100]
+        stats = TaskStats(LocalStore(), LocalStore(), timer=lambda: now[0])
+        self.assertIsNone(stats.median('task', 'run_time'))
+        for wait, run in ((1, 20), (3, 40), (2, 30)):
+            stats.submitted('id', 'task')
+            now[0] += wait
+            stats.started('id')
+            now[0] += run
+            stats.finished('id')
+        hist = stats.histogram('task', 'run_time')
+        self.assertEqual(hist['count'], 3)
+        self.assertEqual(hist['sum'], 90)
+        # Medians are interpolated within histogram buckets
+        self.assertEqual(1.75, stats.median('task', 'queue_wait'))
+        self.assertEqual(25, stats.median('task', 'run_time'))
+
+        stats.submitted('id', 'task')
+        self.assertEqual(stats.remaining('id', states.PENDING), 26.75)
+        self.assertEqual(
+            stats.completion('id', states.PENDING), now[0] + 26.75)
+        now[0] += 10
+        stats.started('id')
+        self.assertEqual(stats.remaining('id', states.STARTED), 25)
+        now[0] += 50
+        self.assertEqual(stats.remaining('id', states.STARTED), 0)
+        self.assertIsNone(stats.remaining('unknown', states.PENDING))
+
+
+class FanOutTest(ResourceTestCaseMixin, TestCase):
+    def test_progress(self):
+        chunk_ids = ['chunk-%d' % i for i in range(4)]
+        backend = MEMORY_APP.backend
+        backend.store_result('chunk-0', [], states.SUCCESS)
+        backend.store_result('chunk-1', [], states.SUCCESS)
+        backend.store_result('chunk-2', None, states.FAILURE)
+        task_id = str(uuid.uuid4())
+        FanOutTestResource._meta.fan_out_store.set(task_id, chunk_ids)
+        data = self.deserialize(self.api_client.get(
+            '/api/v1/fanout/state/{}/'.format(task_id)))
+        self.assertEqual(data['state'], 'PENDING')
+        self.assertEqual(data['progress'], {
+            u'total': 4, u'completed': 2, u'failed': 1, u'pending': 1})
+
+        # New chunk states change the ETag, though the job state didn't
+        state_url = '/api/v1/fanout/state/{}/'.format(task_id)
+        etag = self.api_client.get(state_url)['ETag']
+        self.assertEqual(self.api_client.get(
+            state_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        backend.store_result('chunk-3', [], states.SUCCESS)
+        response = self.api_client.get(state_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertHttpOK(response)
+        self.assertEqual(self.deserialize(response)['progress']['pending'], 0)
+
+
+class BulkRevokeTest(ResourceTestCaseMixin, TestCase):
+    def test_revoke_ids(self):
+        backend = MEMORY_APP.backend
+        task_ids = [str(uuid.uuid4()) for _ in range(3)]
+        backend.store_result(task_ids[0], None, states.SUCCESS)
+        backend.store_result(task_ids[1], None, states.STARTED)
+        response = self.api_client.delete(
+            '/api/v1/fanout/state/?ids={}'.format(','.join(task_ids)))
+        self.assertHttpOK(response)
+        self.assertEqual(self.deserialize(response), {
+            u'finished': [task_ids[0]], u'running': [task_ids[1]],
+            u'revoked': [], u'requested': [task_ids[2]]})
+
+        # PENDING tasks didn't start if started states are tracked
+        MEMORY_APP.conf.CELERY_TRACK_STARTED = True
+        self.addCleanup(
+            setattr, MEMORY_APP.conf, 'CELERY_TRACK_STARTED', False)
+        task_id = str(uuid.uuid4())
+        data = self.deserialize(self.api_client.delete(
+            '/api/v1/fanout/state/?ids={}'.format(task_id)))
+        self.assertEqual(data['revoked'], [task_id])
+        self.assertEqual(data['requested'], [])
+
+    def test_revoke_single(self):
+        # Unfinished tasks are terminated, whatever their state says
+        self.assertHttpGone(self.api_client.delete(
+            '/api/v1/fanout/state/{}/'.format(uuid.uuid4())))
+        task_id = str(uuid.uuid4())
+        MEMORY_APP.backend.store_result(task_id, None, states.SUCCESS)
+        response = self.api_client.delete(
+            '/api/v1/fanout/state/{}/'.format(task_id))
+        self.assertHttpBadRequest(response)
+        self.assertEqual(self.deserialize(response)['finished'], [task_id])
+
+
+class StateWatcherTest(ResourceTestCaseMixin, TestCase):
+    def finish_later(self, task_ids, delay=0.2):
+        def finish():
+            time.sleep(delay)
+            for task_id in task_ids:
+                MEMORY_APP.backend.store_result(
+                    task_id, None, states.SUCCESS)
+        thread = threading.Thread(target=finish)
+        thread.start()
+        return thread
+
+    def test_wait(self):
+        watcher = StateWatcher(
+            interval=0.05,
+            result_backend=CountingResultBackend(MEMORY_APP))
+        task_ids = [str(uuid.uuid4()) for _ in range(3)]
+        found = {}
+
+        def wait(task_id):
+            found[task_id] = watcher.wait_ready(task_id, 5)
+        waiters = [threading.Thread(target=wait, args=(task_id,))
+                   for task_id in task_ids]
+        for thread in waiters:
+            thread.start()
+        self.finish_later(task_ids).join()
+        for thread in waiters:
+            thread.join()
+        self.assertEqual(found, dict.fromkeys(task_ids, states.SUCCESS))
+        # One batch per poll for all waiters, none left afterwards
+        self.assertIn(sorted(task_ids), watcher.result_backend.batches)
+        self.assertEqual(dict(watcher._waiters), {})
+
+        self.assertIsNone(watcher.wait(str(uuid.uuid4()), 0.1, 'PENDING'))
+        self.assertEqual(dict(watcher._waiters), {})
+
+    def test_long_poll(self):
+        task_id = str(uuid.uuid4())
+        thread = self.finish_later([task_id])
+        started = time.time()
+        data = self.deserialize(self.api_client.get(
+            '/api/v1/watched/state/{}/?wait=5'.format(task_id)))
+        thread.join()
+        self.assertEqual(data['state'], 'SUCCESS')
+        self.assertLess(time.time() - started, 2)
+
+    def test_long_poll_backend(self):
+        # Without a watcher, the wait is left to the result backend
+        class PollingResource(BaseAsyncResource):
+            class Meta:
+                resource_name = 'watched'
+                api_name = 'v1'
+                max_state_wait = 5
+                result_backend = ResultBackend(MEMORY_APP)
+
+        task_id = str(uuid.uuid4())
+        thread = self.finish_later([task_id])
+        started = time.time()
+        response = PollingResource().async_state(
+            RequestFactory().get('/?wait=5'), task_id)
+        thread.join()
+        self.assertEqual(self.deserialize(response)['state'], 'SUCCESS')
+        self.assertLess(time.time() - started, 2)
+
+
+class ExecutorTest(ResourceTestCaseMixin, TestCase):
+    def test_thread_executor(self):
+        response = self.api_client.get('/api/v1/executor/1/')
+        self.assertHttpAccepted(response)
+        response = self.api_client.get(response['Location'] + '?wait=5')
+        self.assertEqual(self.deserialize(response)['state'], 'SUCCESS')
+        response = self.api_client.get(
+            self.deserialize(response)['result_uri'])
+        self.assertEqual(
+            self.deserialize(response), {u'id': 1, u'result': u'ok'})
+
+        state_url = self.api_client.post('/api/v1/executor/1/')['Location']
+        response = self.api_client.get(state_url + '?wait=5')
+        self.assertEqual(self.deserialize(response)['state'], 'FAILURE')
+        response = self.api_client.get(
+            self.deserialize(response)['result_uri'])
+        self.assertEqual(
+            self.deserialize(response), {u'error': u'I failed miserably'})
+
+        # 202 is returned before the task is done
+        running = self.api_client.get('/api/v1/executor/')['Location']
+        self.assertIn(self.deserialize(self.api_client.get(
+            running))['state'], ('PENDING', 'STARTED'))
+        # The single worker is busy, queued tasks can be revoked
+        queued = self.api_client.get('/api/v1/executor/')['Location']
+        self.assertHttpGone(self.api_client.delete(queued))
+        response = self.api_client.get(running + '?wait=5')
+        self.assertEqual(self.deserialize(response)['state'], 'SUCCESS')
+        response = self.api_client.get(queued + '?wait=5')
+        self.assertEqual(self.deserialize(response)['state'], 'REVOKED')
+
+        response = self.api_client.get(
+            '/api/v1/executor/state/{}/'.format(uuid.uuid4()))
+        self.assertHttpNotFound(response)
+
+    @override_settings(CELERY_ALWAYS_EAGER=True)
+    def test_group_callback(self):
+        class GroupExecutorResource(BaseAsyncResource):
+            class Meta:
+                resource_name = 'executor'
+                api_name = 'v1'
+                allow_callback_url = True
+                executor = ThreadExecutor(1)
+
+            def async_get_list(self, request, **kwargs):
+                return group(testtasks.quick_task.s(), testtasks.quick_task.s())
+
+        receiver = CallbackReceiver()
+        self.addCleanup(receiver.shutdown)
+        response = GroupExecutorResource().get_list(RequestFactory().get(
+            '/?callback_url=' + receiver.url))
+        self.assertHttpAccepted(response)
+        task_id = response['Location'].split('/')[-2]
+        deadline = time.time() + 5
+        while not receiver.received and time.time() < deadline:
+            time.sleep(0.01)
+        data = json.loads(receiver.received[0][1])
+        self.assertEqual((data['id'], data['state']), (task_id, 'SUCCESS'))
+
+    def test_revoke_tag(self):
+        running = self.api_client.get('/api/v1/executor/?tag=bulk')[
+            'Location']
+        queued = self.api_client.get('/api/v1/executor/?tag=bulk')[
+            'Location']
+        deadline = time.time() + 5
+        while self.deserialize(self.api_client.get(running))['state'] != \
+                'STARTED' and time.time() < deadline:
+            time.sleep(0.01)
+        # Started tasks can't be revoked
+        response = self.api_client.delete(running)
+        self.assertHttpBadRequest(response)
+        self.assertEqual(
+            self.deserialize(response)['running'], [running.split('/')[-2]])
+        data = self.deserialize(
+            self.api_client.delete('/api/v1/executor/state/?tag=bulk'))
+        self.assertEqual(data['running'], [running.split('/')[-2]])
+        self.assertEqual(data['revoked'], [queued.split('/')[-2]])
+        response = self.api_client.get(queued + '?wait=5')
+        self.assertEqual(self.deserialize(response)['state'], 'REVOKED')
+        self.api_client.get(running + '?wait=5')
+
+    def test_hook_result(self):
+        class ResultHookResource(BaseAsyncResource):
+            class Meta:
+                resource_name = 'result-hook'
+                executor = ThreadExecutor(1)
+
+            def async_get_detail(self, request, **kwargs):
+                return testtasks.quick_task.apply()
+
+        self.assertRaises(
+            ImproperlyConfigured, ResultHookResource().get_detail,
+            RequestFactory().get('/'), pk=1)
+
+    def test_partial_results(self):
+        state_url = self.api_client.get('/api/v1/partial/')['Location']
+        result_url = state_url.replace('/state/', '/result/')
+        deadline = time.time() + 5
+        response = self.api_client.get(result_url)
+        while response.status_code == 404 and time.time() < deadline:
+            time.sleep(0.05)
+            response = self.api_client.get(result_url)
+        data = self.deserialize(response)
+        self.assertTrue(data['meta']['incomplete'])
+        # The first batch is written in two chunks
+        count = data['meta']['total_count']
+        self.assertIn(count, (5, 10))
+        self.assertEqual([obj['id'] for obj in data['objects']], range(count))
+        self.assertNotIn('ETag', response)
+
+        self.api_client.get(state_url + '?wait=5')
+        data = self.deserialize(self.api_client.get(result_url))
+        self.assertNotIn('incomplete', data['meta'])
+        self.assertEqual([obj['id'] for obj in data['objects']], range(20))
+
+    def test_process_executor(self):
+        executor = ProcessExecutor(2)
+        try:
+            results = [executor.submit(testtasks.range_task.s(3)),
+                       executor.submit(tasks.failing_task.s())]
+            self.assertEqual(
+                [result.get(timeout=5, propagate=False)
+                 for result in results][0], testtasks.range_task(3))
+            self.assertEqual(results[1].state, states.FAILURE)
+            self.assertEqual(
+                executor.get_result(results[0].id).state, states.SUCCESS)
+        finally:
+            executor.shutdown()
+
+
+class ChunksTest(TestCase):
+    def test_chunked_list(self):
+        store = RecordingChunkStore()
+        objects = [{'id': i} for i in range(25)]
+        items = chunks.ChunkedList(
+            chunks.write(objects, chunk_size=10, store=store), store)
+        self.assertEqual(len(items), 25)
+        self.assertEqual(store.reads, [])
+        self.assertEqual(items[12:17], objects[12:17])
+        self.assertEqual(items[8:12], objects[8:12])
+        self.assertEqual(items[20:100], objects[20:])
+        self.assertEqual(items[30:40], [])
+        self.assertEqual(store.reads, [(1, 1), (0, 1), (2, 2)])
+        self.assertEqual(list(items), objects)
+
+    def test_lazy_chunked_list(self):
+        store = RecordingChunkStore()
+        objects = [{'id': i} for i in range(25)]
+        items = chunks.ChunkedList(
+            chunks.write(objects, chunk_size=10, store=store), store).lazy()
+        page = items[5:]
+        self.assertEqual(len(page), 20)
+        # Only the first chunk is read before iterating
+        self.assertEqual(store.reads, [(0, 0)])
+        iterator = iter(page)
+        self.assertEqual(
+            [next(iterator) for i in range(6)], objects[5:11])
+        self.assertEqual(store.reads, [(0, 0), (1, 1)])
+        self.assertEqual(list(iterator), objects[11:])
+        self.assertEqual(list(items[30:40]), [])
+
+    def test_streamed_chunks(self):
+        store = RecordingChunkStore()
+        objects = [{'id': i, 'result': 'ok'} for i in range(250)]
+        items = chunks.ChunkedList(
+            chunks.write(objects, chunk_size=100, store=store), store)
+        response = StreamingTestResource()._list_response(
+            RequestFactory().get('/?limit=0'), items)
+        self.assertEqual(store.reads, [(0, 0)])
+        data = json.loads(''.join(response.streaming_content))
+        self.assertEqual(data['objects'], objects)
+        self.assertEqual(store.reads, [(0, 0), (1, 1), (2, 2)])
+
+    def test_partial_writer(self):
+        store = chunks.MemoryChunkStore()
+        writer = chunks.PartialWriter('task', chunk_size=10, store=store)
+        self.assertEqual(chunks.read_partial('task', store)['count'], 0)
+        writer.extend([{'id': i} for i in range(15)])
+        self.assertEqual(chunks.read_partial('task', store)['count'], 10)
+        reference = writer.close()
+        self.assertEqual(reference['count'], 15)
+        items = chunks.ChunkedList(reference, store)
+        self.assertEqual(list(items), [{'id': i} for i in range(15)])
+        items.delete()
+        self.assertIsNone(chunks.read_partial('task', store))
+
+    def test_partial_failure(self):
+        task_id = str(uuid.uuid4())
+        result = testtasks.failing_partial_task.apply(task_id=task_id)
+        self.assertEqual(result.state, states.FAILURE)
+        self.assertEqual(str(result.result), 'I failed halfway')
+        self.assertIsNone(chunks.read_partial(task_id))
+        self.assertRaises(
+            KeyError, chunks.CHUNK_STORE.read, task_id, 0, 0)
+
+    def test_file_store(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = chunks.FileChunkStore(directory)
+            objects = [{'id': i} for i in range(25)]
+            reference = chunks.write(objects, chunk_size=10, store=store)
+            items = chunks.ChunkedList(reference, store)
+            self.assertEqual(items[5:25], objects[5:])
+            self.assertEqual(
+                list(chunks.ChunkedList(
+                    chunks.write([], store=store), store)), [])
+            items.delete()
+            self.assertRaises(chunks.ChunksExpired, lambda: items[0:5])
+            store.append('appended', ['[1]'])
+            store.append('appended', ['[2, 3]'])
+            self.assertEqual(store.read('appended', 0, 1), ['[1]', '[2, 3]'])
+        finally:
+            shutil.rmtree(directory)
+
+
+class ExpiryTest(TestCase):
+    def test_registry(self):
+        registry = expiry.LocalExpiryRegistry()
+        registry.add('a', 30)
+        registry.add('b', 10)
+        registry.add('c', 20)
+        registry.add('b', 40)
+        registry.remove('c')
+        self.assertEqual(registry.pop_expired(5), [])
+        self.assertEqual(registry.pop_expired(50, limit=1), ['a'])
+        self.assertEqual(registry.pop_expired(50), ['b'])
+        self.assertEqual(len(registry), 0)
+
+    def test_result_ttl_defaults(self):
+        calls = []
+
+        class OwnBackendResource(BaseAsyncResource):
+            class Meta:
+                resource_name = 'own-backend'
+                result_ttl = 60
+                result_backend = ResultBackend(MEMORY_APP)
+
+            def async_get_detail(self, request, **kwargs):
+                calls.append(kwargs)
+
+        self.assertRaises(
+            ImproperlyConfigured, OwnBackendResource()._result_ttl)
+        self.assertRaises(
+            ImproperlyConfigured, OwnBackendResource().get_detail,
+            RequestFactory().get('/'), pk=1)
+        self.assertEqual(calls, [])
+        self.assertEqual(ExpiringTestResource()._result_ttl(), 60)
+
+    def test_sweep(self):
+        registry = expiry.LocalExpiryRegistry()
+        backend = MEMORY_APP.backend
+        task_id = str(uuid.uuid4())
+        backend.store_result(task_id, 'done', states.SUCCESS)
+        registry.add(task_id, time.time() - 1)
+        registry.add('later', time.time() + 60)
+        store = LocalStore(ttl=-1)
+        store.set('stale', 1)
+        store.set(task_id, states.SUCCESS)
+        metrics = PrometheusMetrics()
+        counts = expiry.sweep(
+            registry, ResultBackend(MEMORY_APP), stores=(store,),
+            metrics=metrics)
+        self.assertEqual(counts, {'expired': 1, 'failed': 0, 'purged': 1})
+        self.assertEqual(backend.get_status(task_id), states.PENDING)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(len(registry), 1)
+        self.assertIn(
+            'tpasync_swept_total{outcome="expired"} 1.0', metrics.render())
+
+
+class EncodingTest(TestCase):
+    def test_serializers(self):
+        value = {'objects': [{'id': i, 'result': 'ok'} for i in range(100)]}
+        content_type, content_encoding, data = dumps(value, 'json+zlib')
+        self.assertEqual(content_encoding, 'binary')
+        self.assertLess(len(data), len(json.dumps(value)))
+        self.assertEqual(loads(
+            data, content_type, content_encoding,
+            accept=[content_type]), value)
+
+    def test_compressed_chunks(self):
+        store = chunks.MemoryChunkStore()
+        objects = [{'id': i} for i in range(25)]
+        reference = chunks.write(
+            objects, chunk_size=10, store=store, compress=True)
+        self.assertTrue(reference['compressed'])
+        self.assertEqual(
+            chunks.ChunkedList(reference, store)[8:12], objects[8:12])
+
+
+class MetricsTest(TestCase):
+    def test_render(self):
+        metrics = PrometheusMetrics(buckets=(1, float('inf')))
+        metrics.increment('requests_total', path='/"a"')
+        metrics.observe('latency_seconds', 0.5)
+        metrics.observe('latency_seconds', 2)
+        self.assertEqual(metrics.render().splitlines(), [
+            '# TYPE requests_total counter',
+            'requests_total{path="/\\"a\\""} 1.0',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="1.0"} 1',
+            'latency_seconds_bucket{le="+Inf"} 2',
+            'latency_seconds_sum 2.5',
+            'latency_seconds_count 2'])
+
+    def test_null_metrics(self):
+        metrics = NullMetrics()
+        with metrics.timer('latency_seconds'):
+            metrics.increment('requests_total')
+        self.assertFalse(hasattr(metrics, 'render'))
+
+
+class AdmissionTest(TestCase):
+    def test_token_bucket(self):
+        now = [0]
+        admission = TokenBucketAdmission(
+            rate=2, burst=3, timer=lambda: now[0])
+        self.assertEqual(
+            [admission.retry_after(None) for i in range(4)],
+            [None, None, None, 0.5])
+        now[0] = 0.5
+        self.assertIsNone(admission.retry_after(None))
+        response = admission.reject(admission.retry_after(None))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+    def test_queue_depth_failure(self):
+        now = [0]
+        calls = []
+
+        class BrokenAdmission(QueueDepthAdmission):
+            def get_depth(self):
+                calls.append(now[0])
+                raise socket.error('Connection refused')
+
+        admission = BrokenAdmission(cache_ttl=5, timer=lambda: now[0])
+        self.assertIsNone(admission.retry_after(None))
+        now[0] = 4
+        self.assertIsNone(admission.retry_after(None))
+        now[0] = 5
+        self.assertIsNone(admission.retry_after(None))
+        # Failures are cached like depths
+        self.assertEqual(calls, [0, 5])
+
+
+class WatchTest(TestCase):
+    def test_watch(self):
+        task = ProgressResult(
+            str(uuid.uuid4()), None, states.PENDING, traceback=None)
+        task.states = [
+            states.STARTED, ('PROGRESS', {'done': 1}),
+            ('PROGRESS', {'done': 2}), ('PROGRESS', {'done': 2}),
+            states.SUCCESS]
+        self.assertEqual(
+            list(watch(task, timeout=10, interval=0)),
+            [states.PENDING, states.STARTED, 'PROGRESS', 'PROGRESS', None,
+             states.SUCCESS])
+
+    def test_events(self):
+        task = ProgressResult(
+            str(uuid.uuid4()), None, states.PENDING, traceback=None)
+        task.states = [
+            ('PROGRESS', {'done': 1}), ('PROGRESS', {'done': 2}),
+            ('PROGRESS', {'done': 2}), (states.SUCCESS, 42)]
+
+        class ProgressResource(BaseAsyncResource):
+            class Meta:
+                resource_name = 'empty'
+                api_name = 'v1'
+                events_interval = 0
+
+            def _get_task(self, task_id):
+                return task
+
+        response = ProgressResource().async_events(
+            RequestFactory().get('/'), task.id)
+        events = [
+            json.loads(event.split('\n')[2][len('data: '):])
+            for event in ''.join(response.streaming_content).split('\n\n')
+            if event.startswith('id:')]
+        self.assertEqual(
+            [(event['state'], event.get('meta')) for event in events],
+            [(states.PENDING, None), ('PROGRESS', {'done': 1}),
+             ('PROGRESS', {'done': 2}), (states.SUCCESS, None)])
+
+
+class LocalStoreTest(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.store = LocalStore(max_size=2, ttl=10, timer=lambda: self.now)
+
+    def test_lru_eviction(self):
+        self.store['a'] = 1
+        self.store['b'] = 2
+        self.assertEqual(self.store['a'], 1)
+        self.store['c'] = 3
+        self.assertNotIn('b', self.store)
+        self.assertIn('a', self.store)
+        self.assertIn('c', self.store)
+        self.assertEqual(self.store.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        self.store.set('a', 1)
+        self.store.set('b', 2, ttl=100)
+        self.now = 10
+        self.assertIsNone(self.store.get('a'))
+        self.assertEqual(self.store.get('b'), 2)
+        self.assertRaises(KeyError, lambda: self.store['a'])
+        stats = self.store.stats()
+        self.assertEqual(stats['expirations'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_weight_eviction(self):
+        store = LocalStore(weigh=len, max_weight=5)
+        store['a'] = 'abc'
+        store['b'] = 'de'
+        self.assertEqual(store.stats()['weight'], 5)
+        store['c'] = 'f'
+        self.assertNotIn('a', store)
+        self.assertEqual(store.stats()['weight'], 3)
+        store['b'] = 'ghijk'
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.stats()['weight'], 5)
+
+    def test_cache_store(self):
+        store = CacheStore(prefix='tpasync-test')
+        self.assertIsNone(store.get('a'))
+        store.set('a', 1, ttl=10)
+        self.assertEqual(store.get('a'), 1)
+        store.delete('a')
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.stats(), {'hits': 1, 'misses': 2})
+
+    def test_append(self):
+        self.store.append('a', [1])
+        self.store.append('a', [2, 3])
+        self.assertEqual(self.store.get_list('a'), [1, 2, 3])
+        self.assertEqual(self.store.get_list('b'), [])
+        self.now = 10
+        self.assertEqual(self.store.get_list('a'), [])
+        self.store.append('a', [4])
+        self.assertEqual(self.store.get_list('a'), [4])
+
+        store = CacheStore(prefix='tpasync-test')
+        store.append('tag', ['a'])
+        store.append('tag', ['b', 'c'])
+        self.assertEqual(store.get_list('tag'), ['a', 'b', 'c'])
+        self.assertEqual(store.get_list('other'), [])
+
+
+class BackendsTest(TestCase):
+    def test_get_states_mget(self):
+        app = Celery(set_as_current=False, backend='cache+memory://')
+        app.backend.store_result('a', 42, states.SUCCESS)
+        app.backend.store_result('b', None, states.STARTED)
+        self.assertEqual(
+            get_states(['a', 'b', 'c'], app=app),
+            {'a': states.SUCCESS, 'b': states.STARTED, 'c': states.PENDING})
+
+    def test_get_results_mget(self):
+        app = Celery(set_as_current=False, backend='cache+memory://')
+        app.backend.store_result('a', [1, 2], states.SUCCESS)
+        self.assertEqual(
+            get_results(['a', 'b'], app=app), {'a': [1, 2], 'b': None})
+
+    def test_result_backend(self):
+        app = Celery(set_as_current=False, backend='cache+memory://')
+        app.backend.store_result('a', 42, states.SUCCESS)
+        backend = ResultBackend(app)
+        self.assertIs(backend.result('a').backend, app.backend)
+        self.assertEqual(backend.result('a').result, 42)
+        self.assertEqual(backend.get_state('a'), states.SUCCESS)
+        self.assertEqual(backend.get_state('b'), states.PENDING)
+
+    @override_settings(TPASYNC_STATE_KEYS=True)
+    def test_state_keys(self):
+        app = Celery(set_as_current=False, backend='cache+memory://')
+        task = app.task(name='tpasync.tests.big')(lambda: None)
+        app.backend.store_result('a', range(1000), states.SUCCESS)
+        signals.task_postrun.send(
+            sender=task, task_id='a', task=task, state=states.SUCCESS)
+        # The state is read from its own key, not from the task meta
+        app.backend.delete(app.backend.get_key_for_task('a'))
+        backend = ResultBackend(app)
+        self.assertEqual(backend.get_state('a'), states.SUCCESS)
+        app.backend.store_result('b', None, states.STARTED)
+        self.assertEqual(
+            backend.get_states(['a', 'b', 'c']),
+            {'a': states.SUCCESS, 'b': states.STARTED, 'c': states.PENDING})
+
+    @unittest.skipIf(DatabaseBackend is None, 'SQLAlchemy is not installed')
+    def test_database_state(self):
+        handle, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        try:
+            app = Celery(
+                set_as_current=False, backend='db+sqlite:///' + path)
+            app.backend.store_result('a', range(1000), states.SUCCESS)
+            backend = ResultBackend(app)
+            self.assertEqual(backend.get_state('a'), states.SUCCESS)
+            self.assertEqual(backend.get_state('b'), states.PENDING)
+            self.assertEqual(
+                backend.get_states(['a', 'b']),
+                {'a': states.SUCCESS, 'b': states.PENDING})
+            self.assertEqual(backend.get_states([]), {})
+        finally:
+            os.remove(path)
@@ -0,0 +1,68 @@
+"""
+Tasks used by tpasync.tests.
+"""
+import time
+
+from celery import shared_task
+
+from .tasks import chunked, partial, rendered
+
+
+@shared_task
+def quick_task():
+    return {'result': 'ok', 'id': 1}
+
+
+@shared_task
+def range_task(count):
+    return [{'result': 'ok', 'id': i} for i in range(count)]
+
+
+@shared_task
+def sleeping_task(seconds):
+    time.sleep(seconds)
+    return {'result': 'ok', 'id': 1}
+
+
+@shared_task
+@rendered(page_size=10)
+def rendered_range_task(count):
+    return [{'result': 'ok', 'id': i} for i in range(count)]
+
+
+@shared_task
+@chunked(chunk_size=10)
+def chunked_range_task(count):
+    return [{'result': 'ok', 'id': i} for i in range(count)]
+
+
+@shared_task
+@chunked(chunk_size=10, compress=True)
+def compressed_range_task(count):
+    return [{'result': 'ok', 'id': i} for i in range(count)]
+
+
+@shared_task
+@partial(chunk_size=5)
+def partial_range_task(count, seconds):
+    yield [{'result': 'ok', 'id': i} for i in range(count)]
+    time.sleep(seconds)
+    yield [{'result': 'ok', 'id': i} for i in range(count, count * 2)]
+
+
+@shared_task
+@partial(chunk_size=1)
+def failing_partial_task():
+    yield [{'result': 'ok', 'id': 0}]
+    raise Exception('I failed halfway')
+
+
+@shared_task
+@rendered()
+def rendered_task():
+    return {'result': 'ok', 'id': 1}
+
+
+@shared_task
+def items_task(ids):
+    return [{'result': 'ok', 'id': i} for i in ids]
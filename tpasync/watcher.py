@@ -0,0 +1,142 @@
+"""
+One poller for all clients waiting on task states.
+
+Long-polling state requests (``?wait``) and event streams normally read the
+result backend once per client. With ``Meta.state_watcher`` set to a
+``StateWatcher``, they register their task with the watcher instead and
+sleep until it reports a new state. A single thread per process reads the
+states of all watched tasks every ``interval`` seconds, in one batch (see
+``ResultBackend.get_states``), and wakes up the clients whose task changed.
+
+Waiting clients still hold a request each. Run the web process with gevent
+workers (e.g. ``gunicorn -k gevent``), where they are cheap, to keep many
+thousands of them open: once patched by gevent, the poller is a greenlet
+and waiters are gevent events. Waiters that time out or are killed
+unregister themselves.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from celery import states
+
+from .backends import RESULT_BACKEND
+
+logger = logging.getLogger(__name__)
+
+
+class StateWatcher(object):
+    """
+    Polls the states of watched tasks from ``result_backend`` (the shared
+    ``RESULT_BACKEND`` by default) every ``interval`` seconds.
+
+    The poller starts with the first waiter and stops when none is left.
+    """
+
+    def __init__(self, interval=0.5, result_backend=None):
+        self.interval = interval
+        self._result_backend = result_backend
+        self._waiters = defaultdict(set)
+        self._states = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def result_backend(self):
+        return self._result_backend or RESULT_BACKEND
+
+    def watches(self, task):
+        """
+        Whether the state of ``task`` can be followed by this watcher.
+        """
+        return task.backend is not None and \
+            task.backend is self.result_backend.backend
+
+    def _poll(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._waiters:
+                    self._thread = None
+                    return
+                task_ids = list(self._waiters)
+            try:
+                found = self.result_backend.get_states(task_ids)
+            except Exception:
+                logger.exception('Reading task states failed')
+                continue
+            with self._lock:
+                for task_id, state in found.items():
+                    waiters = self._waiters.get(task_id)
+                    if waiters and self._states.get(task_id) != state:
+                        self._states[task_id] = state
+                        for event in waiters:
+                            event.set()
+
+    def wait(self, task_id, timeout, previous=None):
+        """
+        Return the state of ``task_id`` once it differs from ``previous``.
+
+        Returns None if that didn't happen within ``timeout`` seconds.
+        """
+        event = threading.Event()
+        with self._lock:
+            self._waiters[task_id].add(event)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll)
+                self._thread.daemon = True
+                self._thread.start()
+            state = self._states.get(task_id)
+        try:
+            deadline = time.time() + timeout
+            while state is None or state == previous:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                event.wait(remaining)
+                event.clear()
+                with self._lock:
+                    state = self._states.get(task_id)
+            return state
+        finally:
+            with self._lock:
+                waiters = self._waiters[task_id]
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[task_id]
+                    self._states.pop(task_id, None)
+
+    def wait_ready(self, task_id, timeout):
+        """
+        Return the state of ``task_id`` once it is ready, or None after
+        ``timeout`` seconds.
+        """
+        deadline = time.time() + timeout
+        state = None
+        while state not in states.READY_STATES:
+            state = self.wait(task_id, deadline - time.time(), state)
+            if state is None:
+                return None
+        return state
+
+    def watch(self, task_id, timeout, interval=1.0):
+        """
+        Follow the state of ``task_id`` like ``tpasync.backends.watch``.
+
+        Yields the state whenever it changes, and None when it didn't
+        change for ``interval`` seconds. Stops after the task is ready or
+        ``timeout`` seconds.
+        """
+        deadline = time.time() + timeout
+        previous = None
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            state = self.wait(task_id, min(interval, remaining), previous)
+            yield state
+            if state is not None:
+                previous = state
+                if state in states.READY_STATES:
+                    return
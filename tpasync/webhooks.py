@@ -0,0 +1,47 @@
+"""
+Completion callbacks (webhooks).
+
+Tasks that deliver callbacks are in ``tpasync.tasks``, they are routed to
+the ``TPASYNC_WEBHOOK_QUEUE`` queue if set. Run a dedicated worker with a
+small concurrency on that queue to bound the number of concurrent
+deliveries. If ``TPASYNC_WEBHOOK_SECRET`` is set, the body of every callback
+is signed with HMAC-SHA256, the signature is sent in the
+``X-Tpasync-Signature`` header as ``sha256=<hex digest>``.
+"""
+import hashlib
+import hmac
+import json
+import urllib2
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def sign(body, secret=None):
+    """
+    Return the signature header value for ``body``.
+    """
+    secret = secret or getattr(settings, 'TPASYNC_WEBHOOK_SECRET')
+    return 'sha256=%s' % hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+def post_callback(callback_url, data, timeout=10):
+    """
+    POST ``data`` as JSON to ``callback_url``.
+
+    Raises ``urllib2.URLError`` (or ``HTTPError``) if delivery failed.
+    """
+    body = json.dumps(data, cls=DjangoJSONEncoder)
+    request = urllib2.Request(
+        callback_url, body, {'Content-Type': 'application/json'})
+    if getattr(settings, 'TPASYNC_WEBHOOK_SECRET', None):
+        request.add_header('X-Tpasync-Signature', sign(body))
+    urllib2.urlopen(request, timeout=timeout).close()
+
+
+def task_options():
+    """
+    Options used to send callback tasks.
+    """
+    queue = getattr(settings, 'TPASYNC_WEBHOOK_QUEUE', None)
+    return {'queue': queue} if queue else {}